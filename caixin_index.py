@@ -1,9 +1,567 @@
 # index.py
+import asyncio
+import hashlib
 import json
 import os
+import socket
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
 
-def handler(event, context):
+try:
+    import httpx
+except ImportError:  # 可选依赖，部署异步入口时加入函数依赖；未安装时退回线程池，经同步连接池调用上游
+    httpx = None
+
+API_URL = os.environ.get('UPSTREAM_API_URL', 'https://api.302.ai/v1/chat/completions')
+
+# ========== 上游连接池：每个函数实例只建一次，热实例的后续调用复用 TCP/TLS 连接 ==========
+# 记录当前线程本次请求的建连耗时；复用已有连接时保持为 0
+_timing = threading.local()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        t0 = time.perf_counter()
+        super().connect()
+        _timing.connect = getattr(_timing, 'connect', 0.0) + time.perf_counter() - t0
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        t0 = time.perf_counter()
+        super().connect()  # 含 TCP 握手与 TLS 握手
+        _timing.connect = getattr(_timing, 'connect', 0.0) + time.perf_counter() - t0
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _UpstreamAdapter(HTTPAdapter):
+    """连接池 + TCP keep-alive，并记录建连耗时"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ]
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
+
+
+# 上游明确表示“稍后再试”（限流/过载且带 Retry-After）时请求并未被处理，才按状态码重试；
+# 502/504 时上游可能已经在生成，重发会重复计费，且客户端自己也会重试
+UPSTREAM_RETRY_STATUS = (429, 503)
+
+
+class _UpstreamRetry(Retry):
+    def is_retry(self, method, status_code, has_retry_after=False):
+        return has_retry_after and super().is_retry(method, status_code, has_retry_after)
+
+
+def _build_session():
+    pool_size = int(os.environ.get('UPSTREAM_POOL_SIZE', '10'))
+    # 只重试建连失败与带 Retry-After 的限流；读超时不重试，避免同一请求被模型重复计费
+    retry = _UpstreamRetry(
+        total=2,
+        connect=2,
+        read=0,
+        status=1,
+        status_forcelist=UPSTREAM_RETRY_STATUS,
+        allowed_methods=frozenset({'POST'}),
+        backoff_factor=0.5,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = _UpstreamAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry, pool_block=False)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+SESSION = _build_session()
+_stats = {'calls': 0, 'reused': 0, 'connect_seconds': 0.0}
+_stats_lock = threading.Lock()
+
+
+def post_upstream(payload, req_headers, timeout=120, stream=False):
+    """经共享连接池调用上游，打印建连耗时与模型耗时"""
+    _timing.connect = 0.0
+    t0 = time.perf_counter()
+    response = SESSION.post(API_URL, headers=req_headers, json=payload, timeout=timeout, stream=stream)
+    total = time.perf_counter() - t0
+    connect = _timing.connect
+    with _stats_lock:
+        _stats['calls'] += 1
+        _stats['reused'] += 0 if connect else 1
+        _stats['connect_seconds'] += connect
+        calls, reused = _stats['calls'], _stats['reused']
+    print(
+        f"=== Upstream timing: connect {connect * 1000:.0f} ms"
+        f"{' (reused connection)' if not connect else ''}, model {total - connect:.2f} s, "
+        f"instance calls {calls}, reused {reused} ==="
+    )
+    return response
+
+
+def _is_timeout(e):
+    if isinstance(e, requests.exceptions.Timeout):
+        return True
+    return httpx is not None and isinstance(e, httpx.TimeoutException)
+# ================================================================================
+
+
+# ========== 响应缓存：相同请求（model + messages）直接复用上一次的模型输出 ==========
+# RESPONSE_CACHE 环境变量选择后端：
+#   memory（默认）           每个实例内的 LRU，RESPONSE_CACHE_MAX_ENTRIES 条
+#   file:///mnt/nas/ai-cache  目录缓存，挂载同一 NAS 的实例之间共享
+#   redis://host:6379/0       Redis（或兼容协议的服务），需要在函数依赖中加入 redis 包
+#   off                       关闭
+# RESPONSE_CACHE_TTL 为过期秒数（默认 1 天）。只缓存 2xx 且（批量模式下）能解析为 JSON 的结果。
+# 缓存读写失败只打印告警并按未命中处理，不影响正常请求。
+class MemoryResponseCache:
+    name = 'memory'
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry['expires'] < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._data[key] = dict(entry, expires=time.time() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+
+class FileResponseCache:
+    name = 'file'
+    # 写入时顺带清理过期文件的最短间隔（秒）；从未再被读到的条目只能靠它删除
+    SWEEP_INTERVAL = 600
+
+    def __init__(self, ttl, directory):
+        self.ttl = ttl
+        self.directory = directory
+        self._next_sweep = time.time() + min(ttl, self.SWEEP_INTERVAL)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"=== WARN: response cache read failed: {type(e).__name__}: {str(e)} ===")
+            return None
+        if entry.get('expires', 0) >= time.time():
+            return entry
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+    def set(self, key, entry):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(dict(entry, expires=time.time() + self.ttl), f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"=== WARN: response cache write failed: {type(e).__name__}: {str(e)} ===")
+        if time.time() >= self._next_sweep:
+            self.sweep()
+
+    def sweep(self):
+        """删除已过期的缓存文件（按修改时间 + ttl 判断，不必逐个解析）与中断写入遗留的临时文件，返回删除数"""
+        now = time.time()
+        self._next_sweep = now + min(self.ttl, self.SWEEP_INTERVAL)
+        removed = 0
+        for root, _dirs, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) + self.ttl < now:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        if removed:
+            print(f"=== Response cache sweep: removed {removed} expired files ===")
+        return removed
+
+
+class RedisResponseCache:
+    name = 'redis'
+
+    def __init__(self, ttl, url):
+        import redis  # 只有选用 Redis 后端时才需要
+        self.ttl = ttl
+        self.client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+
+    def get(self, key):
+        try:
+            raw = self.client.get('ai-response:' + key)
+        except Exception as e:
+            print(f"=== WARN: response cache read failed: {type(e).__name__}: {str(e)} ===")
+            return None
+        return json.loads(raw) if raw else None
+
+    def set(self, key, entry):
+        try:
+            self.client.set('ai-response:' + key, json.dumps(entry, ensure_ascii=False), ex=int(self.ttl))
+        except Exception as e:
+            print(f"=== WARN: response cache write failed: {type(e).__name__}: {str(e)} ===")
+
+
+def _build_response_cache():
+    spec = os.environ.get('RESPONSE_CACHE', 'memory').strip()
+    ttl = float(os.environ.get('RESPONSE_CACHE_TTL', '86400'))
+    if spec in ('', 'off', 'none'):
+        return None
+    try:
+        if spec.startswith('file://'):
+            return FileResponseCache(ttl, spec[len('file://'):])
+        if spec.startswith(('redis://', 'rediss://', 'unix://')):
+            return RedisResponseCache(ttl, spec)
+    except Exception as e:
+        print(f"=== WARN: response cache {spec} unavailable ({type(e).__name__}: {str(e)}), using memory ===")
+    return MemoryResponseCache(ttl, int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '256')))
+
+
+RESPONSE_CACHE = _build_response_cache()
+_cache_stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'saved_seconds': 0.0}
+# 进行中的请求：同一 key 只让第一个请求调用上游，其余请求等待并共享它的结果
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def response_cache_key(payload):
+    """上游请求体的规范化哈希：键顺序、空白不影响结果"""
+    canonical = json.dumps(
+        {'model': payload.get('model'), 'messages': payload.get('messages')},
+        ensure_ascii=False, sort_keys=True, separators=(',', ':'),
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _record_cache_use(kind, saved):
+    with _stats_lock:
+        _cache_stats[kind] += 1
+        _cache_stats['saved_seconds'] += saved
+        hits = _cache_stats['hits'] + _cache_stats['coalesced']
+        total = hits + _cache_stats['misses']
+        total_saved = _cache_stats['saved_seconds']
+    label = {'hits': 'hit', 'misses': 'miss', 'coalesced': 'coalesced'}[kind]
+    print(
+        f"=== Response cache: {label} ({RESPONSE_CACHE.name}), saved {saved:.2f} s; "
+        f"instance hit rate {hits}/{total} ({hits / total:.0%}), saved {total_saved:.1f} s total ==="
+    )
+
+
+def _call_upstream(payload, req_headers, timeout):
+    t0 = time.perf_counter()
+    response = post_upstream(payload, req_headers, timeout=timeout)
+    return {
+        'status': response.status_code,
+        'text': response.text,
+        'seconds': time.perf_counter() - t0,
+        'source': 'upstream',
+    }
+
+
+def cached_completion(payload, req_headers, timeout=120, use_cache=True, validate=None):
+    """带缓存与请求合并的上游调用，返回 {"status", "text", "seconds", "source"}
+
+    source 为 upstream / cache / coalesced；validate(text) 返回 False 的结果不写入缓存
+    """
+    if RESPONSE_CACHE is None or not use_cache:
+        return _call_upstream(payload, req_headers, timeout)
+
+    key = response_cache_key(payload)
+    entry = RESPONSE_CACHE.get(key)
+    if entry is not None:
+        _record_cache_use('hits', entry['seconds'])
+        return {'status': entry['status'], 'text': entry['text'], 'seconds': entry['seconds'], 'source': 'cache'}
+
+    with _inflight_lock:
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _inflight[key] = {'done': threading.Event(), 'result': None, 'error': None}
+    if not leader:
+        flight['done'].wait()
+        if flight['error'] is not None:
+            raise flight['error']
+        result = flight['result']
+        _record_cache_use('coalesced', result['seconds'])
+        return dict(result, source='coalesced')
+
+    try:
+        result = _call_upstream(payload, req_headers, timeout)
+        _record_cache_use('misses', 0.0)
+        if 200 <= result['status'] < 300 and (validate is None or validate(result['text'])):
+            RESPONSE_CACHE.set(key, {'status': result['status'], 'text': result['text'], 'seconds': result['seconds']})
+        flight['result'] = result
+    except Exception as e:
+        flight['error'] = e
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        flight['done'].set()
+    return result
+# ================================================================================
+
+
+def completion_content(text):
+    """取出 chat/completions 响应中的模型输出文本"""
+    data = json.loads(text)
+    return (
+        data.get('choices', [{}])[0]
+            .get('message', {})
+            .get('content', '')
+    )
+
+
+def resolve_cors_origin(request_origin):
+    """按 ALLOWED_ORIGINS 校验请求来源，返回应答使用的 CORS 来源；来源不在白名单时返回 None"""
+    # 获取环境变量中配置的允许来源
+    allowed_origins = os.environ.get('ALLOWED_ORIGINS', '*')
+
+    print(f"=== Request Origin: {request_origin} ===")
+    print(f"=== Allowed Origins: {allowed_origins} ===")
+
+    if allowed_origins == '*':
+        return '*'
+    allowed_list = [origin.strip() for origin in allowed_origins.split(',')]
+    if request_origin not in allowed_list:
+        print(f"=== BLOCKED: Origin {request_origin} not in allowed list ===")
+        return None
+    return request_origin
+
+
+def build_messages(body):
+    """兼容两种输入：issueId/articles/prompt 或直接透传 messages
+
+    返回 (issue_id, articles, model, messages)；articles 为 None 表示透传模式
+    """
+    issue_id = body.get('issueId')
+    articles = body.get('articles') if isinstance(body.get('articles'), list) else None
+    prompt_text = body.get('prompt')
+    model = body.get('model', 'gemini-2.5-pro')
+
+    if articles:
+        # 适配批量摘要/洞察：把 articles 映射为一个 user 消息，让模型严格返回 JSON
+        # 保留你提供的 prompt 作为 system 或补默认
+        system_content = prompt_text or (
+            "你是一名资深财经编辑。基于我提供的每篇 {id,title,content}，为每篇生成 summary(≤200字) 和 insight(≤500字)。"
+            "仅输出严格的 JSON: {\"issueId\":\"...\",\"articles\":[{\"id\":\"...\",\"summary\":\"...\",\"insight\":\"...\"}]}，不要解释。"
+        )
+        user_payload = {
+            'issueId': issue_id or 'unknown-issue',
+            'articles': [
+                {
+                    'id': str(a.get('id')),
+                    'title': a.get('title', ''),
+                    'content': a.get('content', ''),
+                }
+                for a in articles
+            ]
+        }
+        messages = [
+            {'role': 'system', 'content': system_content},
+            {'role': 'user', 'content': json.dumps(user_payload, ensure_ascii=False)}
+        ]
+    else:
+        # 兼容旧接口：直接透传 messages
+        messages = body.get('messages', [])
+    return issue_id, articles, model, messages
+
+
+def parse_batch_content(content, issue_id):
+    """尽力把模型输出解析为 {issueId, articles}；不是合法的批量 JSON 时返回 None"""
+    # 模型可能在 JSON 外包裹 ```json ... ```，需要清理
+    content = content.strip()
+    if content.startswith('```json'):
+        content = content[7:]  # 去掉开头的 ```json
+    if content.startswith('```'):
+        content = content[3:]
+    if content.endswith('```'):
+        content = content[:-3]
+    content = content.strip()
+
+    try:
+        parsed = json.loads(content)
+    except ValueError:
+        return None
+    # 简单校验
+    if not isinstance(parsed, dict) or 'articles' not in parsed:
+        return None
+    return {
+        'issueId': parsed.get('issueId') or (issue_id or 'unknown-issue'),
+        'articles': [
+            {
+                'id': str(it.get('id', '')),
+                'summary': it.get('summary', ''),
+                'insight': it.get('insight', ''),
+            }
+            for it in parsed.get('articles', [])
+        ]
+    }
+
+
+# ========== 大批量拆分：按篇数与正文长度切块，并发调用上游后按原顺序合并 ==========
+FANOUT_MAX_ARTICLES = int(os.environ.get('FANOUT_MAX_ARTICLES', '5'))
+FANOUT_MAX_CHARS = int(os.environ.get('FANOUT_MAX_CHARS', '30000'))
+FANOUT_CONCURRENCY = int(os.environ.get('FANOUT_CONCURRENCY', '4'))
+
+
+def chunk_articles(articles, max_articles=FANOUT_MAX_ARTICLES, max_chars=FANOUT_MAX_CHARS):
+    """按原顺序切块：每块不超过 max_articles 篇、标题与正文合计不超过 max_chars 字（单篇超长时独占一块）"""
+    chunks = []
+    current, size = [], 0
+    for a in articles:
+        length = len(a.get('title', '') or '') + len(a.get('content', '') or '')
+        if current and (len(current) >= max_articles or size + length > max_chars):
+            chunks.append(current)
+            current, size = [], 0
+        current.append(a)
+        size += length
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _chunk_request(body, chunk):
+    """一块文章对应的上游请求：返回 (文章 id 列表, issue_id, payload, validate)"""
+    ids = [str(a.get('id')) for a in chunk]
+    issue_id, _, model, messages = build_messages(dict(body, articles=chunk))
+    validate = lambda text: parse_batch_content(completion_content(text), issue_id) is not None
+    return ids, issue_id, {"model": model, "messages": messages}, validate
+
+
+def _chunk_outcome(ids, issue_id, upstream=None, error=None):
+    """把一块的上游结果拆成 ({id: 结果}, {id: 失败原因})"""
+    if error is not None:
+        if _is_timeout(error):
+            return {}, {i: 'Request timeout after 120 seconds' for i in ids}
+        return {}, {i: f'{type(error).__name__}: {str(error)}' for i in ids}
+
+    if not 200 <= upstream['status'] < 300:
+        return {}, {i: f"Upstream status {upstream['status']}: {upstream['text'][:200]}" for i in ids}
+    try:
+        parsed = parse_batch_content(completion_content(upstream['text']), issue_id)
+    except Exception:
+        parsed = None
+    if parsed is None:
+        return {}, {i: 'Model output is not valid batch JSON' for i in ids}
+
+    done = {it['id']: it for it in parsed['articles'] if it['id'] in ids}
+    return done, {i: 'Missing from model output' for i in ids if i not in done}
+
+
+def _summarize_chunk(body, chunk, req_headers, use_cache):
+    ids, issue_id, payload, validate = _chunk_request(body, chunk)
+    try:
+        upstream = cached_completion(payload, req_headers, timeout=120, use_cache=use_cache, validate=validate)
+    except Exception as e:
+        return _chunk_outcome(ids, issue_id, error=e)
+    return _chunk_outcome(ids, issue_id, upstream)
+
+
+def _merge_chunks(body, articles, outcomes, t0):
+    """按输入顺序合并各块结果：{"issueId", "articles", "failed"}"""
+    done, errors = {}, {}
+    for chunk_done, chunk_errors in outcomes:
+        done.update(chunk_done)
+        errors.update(chunk_errors)
+
+    ordered = [str(a.get('id')) for a in articles]
+    result = {
+        'issueId': body.get('issueId') or 'unknown-issue',
+        'articles': [done[i] for i in ordered if i in done],
+        'failed': [{'id': i, 'error': errors[i]} for i in ordered if i in errors],
+    }
+    print(f"=== Fan-out finished: {len(result['articles'])} ok, {len(result['failed'])} failed, "
+          f"{time.perf_counter() - t0:.2f} s ===")
+    return result
+
+
+def summarize_fanout(body, articles, req_headers, use_cache=True):
+    """把大批量拆成多次上游调用并发执行，按输入顺序合并
+
+    返回 {"issueId", "articles", "failed"}；failed 为 [{"id", "error"}]，单块失败只影响该块的文章
+    """
+    chunks = chunk_articles(articles)
+    workers = max(1, min(FANOUT_CONCURRENCY, len(chunks)))
+    print(f"=== Fan-out: {len(articles)} articles in {len(chunks)} calls, concurrency {workers} ===")
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        outcomes = list(pool.map(lambda chunk: _summarize_chunk(body, chunk, req_headers, use_cache), chunks))
+    return _merge_chunks(body, articles, outcomes, t0)
+# ================================================================================
+
+
+CORS_RESPONSE_HEADERS = {
+    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Accept'
+}
+
+
+def json_response(status_code, body_text, cors_origin):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': cors_origin,
+            **CORS_RESPONSE_HEADERS,
+        },
+        'body': body_text
+    }
+
+
+def parse_event(event):
+    """解析 FC 事件、校验来源并处理 OPTIONS 预检
+
+    返回 (提前结束的响应, None) 或 (None, 请求上下文)；同步与异步入口共用
+    """
     # =============== 调试：打印原始 event ===============
     print("=== Raw event type:", type(event), "===")
     print("=== Raw event:", event, "===")
@@ -18,7 +576,7 @@ def handler(event, context):
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({'error': f'Failed to decode event bytes: {str(e)}'})
-            }
+            }, None
     elif isinstance(event, str):
         event_str = event
     else:
@@ -33,38 +591,16 @@ def handler(event, context):
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': f'Invalid event JSON: {str(e)}'})
-        }
+        }, None
 
     # ========== 👇 在这里添加新代码：验证请求来源 ==========
-    # 获取环境变量中配置的允许来源
-    allowed_origins = os.environ.get('ALLOWED_ORIGINS', '*')
-
     # 获取请求的 Origin（处理大小写不敏感）
     headers = event_dict.get('headers', {})
     request_origin = headers.get('origin') or headers.get('Origin') or headers.get('ORIGIN') or ''
 
-    print(f"=== Request Origin: {request_origin} ===")
-    print(f"=== Allowed Origins: {allowed_origins} ===")
-
-    # 验证来源
-    if allowed_origins != '*':
-        allowed_list = [origin.strip() for origin in allowed_origins.split(',')]
-        
-        if request_origin not in allowed_list:
-            print(f"=== BLOCKED: Origin {request_origin} not in allowed list ===")
-            return {
-                'statusCode': 403,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': request_origin if request_origin else '*',
-                    'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                    'Access-Control-Allow-Headers': 'Content-Type, Accept'
-                },
-                'body': json.dumps({'error': 'Origin not allowed'})
-            }
-        cors_origin = request_origin
-    else:
-        cors_origin = '*'
+    cors_origin = resolve_cors_origin(request_origin)
+    if cors_origin is None:
+        return json_response(403, json.dumps({'error': 'Origin not allowed'}), request_origin or '*'), None
 
     print(f"=== CORS Origin set to: {cors_origin} ===")
     # ========== 👆 新增代码结束 ==========
@@ -83,12 +619,11 @@ def handler(event, context):
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': cors_origin,
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, Accept',
+                **CORS_RESPONSE_HEADERS,
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
-        }
+        }, None
     # ================================================
 
     # Step 3: 获取 body 字段（它是一个 JSON 字符串）
@@ -103,7 +638,7 @@ def handler(event, context):
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({'error': f'Invalid request body JSON: {str(e)}'})
-            }
+            }, None
     else:
         body = raw_body  # 理论上不会发生，但兜底
 
@@ -114,142 +649,448 @@ def handler(event, context):
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': cors_origin},
             'body': json.dumps({'error': 'API key not configured in environment variables'})
-        }
+        }, None
 
-    API_URL = "https://api.302.ai/v1/chat/completions"
+    issue_id, articles, model, messages = build_messages(body)
+    return None, {
+        'cors_origin': cors_origin,
+        'body': body,
+        'issue_id': issue_id,
+        'articles': articles,
+        'model': model,
+        'messages': messages,
+        'payload': {"model": model, "messages": messages},
+        'req_headers': {
+            'Accept': 'application/json',
+            'Authorization': f'Bearer {API_KEY}',
+            'Content-Type': 'application/json'
+        },
+        'use_cache': body.get('cache', True) is not False,
+        # 超过一块的批量请求拆分并发调用，避免单次生成超时或输出被截断
+        'fanout': bool(articles) and len(chunk_articles(articles)) > 1,
+    }
 
-    # 读取可能的两种输入
-    issue_id = body.get('issueId')
-    articles = body.get('articles') if isinstance(body.get('articles'), list) else None
-    prompt_text = body.get('prompt')
-    model = body.get('model', 'gemini-2.5-pro')
 
-    if articles:
-        # 适配批量摘要/洞察：把 articles 映射为一个 user 消息，让模型严格返回 JSON
-        # 保留你提供的 prompt 作为 system 或补默认
-        system_content = prompt_text or (
-            "你是一名资深财经编辑。基于我提供的每篇 {id,title,content}，为每篇生成 summary(≤200字) 和 insight(≤500字)。"
-            "仅输出严格的 JSON: {\"issueId\":\"...\",\"articles\":[{\"id\":\"...\",\"summary\":\"...\",\"insight\":\"...\"}]}，不要解释。"
+def completion_response(upstream, request):
+    """把上游结果转换为函数响应：批量模式尽力解析为 {issueId, articles}，否则原样透传"""
+    articles, issue_id, cors_origin = request['articles'], request['issue_id'], request['cors_origin']
+    print(f"=== 302.ai Response Status: {upstream['status']} ({upstream['source']}) ===")
+    print(f"=== Response length: {len(upstream['text'])} bytes ===")
+
+    # 如果是批量摘要/洞察输入，尽力解析模型输出为目标结构
+    if articles and 200 <= upstream['status'] < 300:
+        try:
+            content = completion_content(upstream['text'])
+            result = parse_batch_content(content, issue_id)
+            if result is not None:
+                return json_response(200, json.dumps(result, ensure_ascii=False), cors_origin)
+        except Exception as _:
+            # 解析失败时，回落为原始返回，便于排查 prompt
+            pass
+
+    # 其它情况：原样透传（保持你原来的行为）
+    return json_response(upstream['status'], upstream['text'], cors_origin)
+
+
+def fanout_response(result, cors_origin):
+    return json_response(200 if result['articles'] else 502, json.dumps(result, ensure_ascii=False), cors_origin)
+
+
+def error_response(e, cors_origin):
+    if _is_timeout(e):
+        print("=== ERROR: Request timeout ===")
+        return json_response(504, json.dumps({'error': 'Request timeout after 120 seconds'}), cors_origin)
+    print(f"=== ERROR: {type(e).__name__}: {str(e)} ===")
+    import traceback
+    print(f"=== Traceback: ===")
+    traceback.print_exc()
+    return json_response(500, json.dumps({'error': f'Internal error: {str(e)}'}), cors_origin)
+
+
+def _batch_validator(request):
+    # 批量模式下只缓存能解析为目标 JSON 的输出，避免把一次格式错误的回答缓存下来
+    if not request['articles']:
+        return None
+    return lambda text: parse_batch_content(completion_content(text), request['issue_id']) is not None
+
+
+def _log_call(request):
+    print(f"=== Calling 302.ai API ===")
+    print(f"Model: {request['model']}")
+    print(f"Messages count: {len(request['messages'])}")
+
+
+def handler(event, context):
+    early, request = parse_event(event)
+    if early is not None:
+        return early
+
+    if request['fanout']:
+        result = summarize_fanout(
+            request['body'], request['articles'], request['req_headers'], use_cache=request['use_cache']
         )
-        user_payload = {
-            'issueId': issue_id or 'unknown-issue',
-            'articles': [
-                {
-                    'id': str(a.get('id')),
-                    'title': a.get('title', ''),
-                    'content': a.get('content', ''),
-                }
-                for a in articles
-            ]
-        }
-        messages = [
-            {'role': 'system', 'content': system_content},
-            {'role': 'user', 'content': json.dumps(user_payload, ensure_ascii=False)}
-        ]
-    else:
-        # 兼容旧接口：直接透传 messages
-        messages = body.get('messages', [])
+        return fanout_response(result, request['cors_origin'])
+
+    try:
+        _log_call(request)
+        upstream = cached_completion(
+            request['payload'], request['req_headers'], timeout=120,
+            use_cache=request['use_cache'], validate=_batch_validator(request),
+        )
+        return completion_response(upstream, request)
+    except Exception as e:
+        return error_response(e, request['cors_origin'])
+
+
+# ========== 流式模式（SSE）：HTTP 触发器的 WSGI 入口 ==========
+# 部署为单独的 HTTP 函数，入口 index.stream_handler。请求体与 handler 相同；
+# 上游以 stream: true 调用，模型每吐出一段文本就转成一条 SSE 事件推给客户端：
+#   event: delta   data: {"content": "..."}                逐段文本
+#   event: result  data: {"issueId": ..., "articles": [...]}  批量模式下，拼接后的完整输出解析成功
+#   event: done    data: {"content": "..."}                透传模式，或批量输出无法解析为 JSON
+#   event: error   data: {"error": "..."}                  流已开始后上游中断
+SSE_HEADERS = [
+    ('Content-Type', 'text/event-stream; charset=utf-8'),
+    ('Cache-Control', 'no-cache'),
+    ('X-Accel-Buffering', 'no'),  # 关闭网关缓冲，保证逐条下发
+]
+HTTP_STATUS_TEXT = {
+    200: '200 OK', 400: '400 Bad Request', 403: '403 Forbidden',
+    500: '500 Internal Server Error', 502: '502 Bad Gateway', 504: '504 Gateway Timeout',
+}
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+
+
+def _iter_sse_lines(response):
+    """按到达的数据逐行产出上游响应
 
-    payload = {"model": model, "messages": messages}
+    iter_lines() 的默认 512 字节块要凑满才交出；chunk_size=None 只对分块编码的响应有效，
+    上游以关闭连接结束响应时会一直读到 EOF。read1() 有多少返回多少，两种情况都能即时交出。
+    """
+    raw = response.raw
+    if not hasattr(raw, 'read1'):  # urllib3 < 2.3
+        yield from response.iter_lines(chunk_size=1)
+        return
+    buf = b''
+    while True:
+        data = raw.read1(8192, decode_content=True)  # requests 创建的 raw 默认不解压
+        if not data:
+            break
+        buf += data
+        *lines, buf = buf.split(b'\n')
+        for line in lines:
+            yield line.rstrip(b'\r')
+    if buf:
+        yield buf
+
+
+def iter_upstream_deltas(response):
+    """逐条解析上游 SSE（OpenAI 兼容格式），产出每段增量文本"""
+    for line in _iter_sse_lines(response):
+        if not line.startswith(b'data:'):
+            continue
+        data = line[5:].strip()
+        if data == b'[DONE]':
+            break
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            continue
+        choices = chunk.get('choices') or [{}]
+        text = (choices[0].get('delta') or {}).get('content')
+        if text:
+            yield text
+
+
+def stream_handler(environ, start_response):
+    request_origin = environ.get('HTTP_ORIGIN', '')
+    cors_origin = resolve_cors_origin(request_origin)
+    cors_headers = [
+        ('Access-Control-Allow-Origin', cors_origin or request_origin or '*'),
+        ('Access-Control-Allow-Methods', 'POST, OPTIONS'),
+        ('Access-Control-Allow-Headers', 'Content-Type, Accept'),
+    ]
+
+    def json_response(status, data):
+        start_response(HTTP_STATUS_TEXT.get(status, f'{status} Error'),
+                       [('Content-Type', 'application/json')] + cors_headers)
+        return [json.dumps(data, ensure_ascii=False).encode('utf-8')]
+
+    if cors_origin is None:
+        return json_response(403, {'error': 'Origin not allowed'})
+    if environ.get('REQUEST_METHOD', 'POST').upper() == 'OPTIONS':
+        start_response('200 OK', cors_headers + [('Access-Control-Max-Age', '86400')])
+        return [b'']
+
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = json.loads(environ['wsgi.input'].read(length) or b'{}')
+    except Exception as e:
+        return json_response(400, {'error': f'Invalid request body JSON: {str(e)}'})
+
+    API_KEY = os.environ.get('THIRTY_TWO_AI_API_KEY')
+    if not API_KEY:
+        return json_response(500, {'error': 'API key not configured in environment variables'})
+
+    issue_id, articles, model, messages = build_messages(body)
+    payload = {"model": model, "messages": messages, "stream": True}
     req_headers = {
-        'Accept': 'application/json',
+        'Accept': 'text/event-stream',
         'Authorization': f'Bearer {API_KEY}',
         'Content-Type': 'application/json'
     }
 
+    def final_event(content):
+        result = parse_batch_content(content, issue_id) if articles else None
+        if result is not None:
+            return sse_event('result', result)
+        return sse_event('done', {'content': content})
+
+    # 缓存与非流式 handler 共用：命中时一次性回放完整输出（流式请求之间不做合并）
+    use_cache = RESPONSE_CACHE is not None and body.get('cache', True) is not False
+    cache_key = response_cache_key(payload) if use_cache else None
+    entry = RESPONSE_CACHE.get(cache_key) if use_cache else None
+    if entry is not None:
+        _record_cache_use('hits', entry['seconds'])
+        content = completion_content(entry['text'])
+        start_response('200 OK', SSE_HEADERS + cors_headers)
+        return [sse_event('delta', {'content': content}), final_event(content)]
+
+    print(f"=== Calling 302.ai API (stream) ===")
+    print(f"Model: {model}")
+    print(f"Messages count: {len(messages)}")
+    t0 = time.perf_counter()
+    try:
+        # 流式下 timeout 约束的是相邻两段数据的间隔，而不是整次生成
+        response = post_upstream(payload, req_headers, timeout=120, stream=True)
+    except requests.exceptions.Timeout:
+        print("=== ERROR: Request timeout ===")
+        return json_response(504, {'error': 'Request timeout after 120 seconds'})
+    except Exception as e:
+        print(f"=== ERROR: {type(e).__name__}: {str(e)} ===")
+        return json_response(500, {'error': f'Internal error: {str(e)}'})
+
+    print(f"=== 302.ai Response Status: {response.status_code} ===")
+    if not response.ok:
+        # 流尚未开始，按原状态码透传上游错误
+        text = response.text
+        response.close()
+        start_response(HTTP_STATUS_TEXT.get(response.status_code, f'{response.status_code} Error'),
+                       [('Content-Type', 'application/json')] + cors_headers)
+        return [text.encode('utf-8')]
+
+    start_response('200 OK', SSE_HEADERS + cors_headers)
+
+    def generate():
+        parts = []
+        first = None
+        try:
+            for text in iter_upstream_deltas(response):
+                if first is None:
+                    first = time.perf_counter() - t0
+                parts.append(text)
+                yield sse_event('delta', {'content': text})
+        except Exception as e:
+            print(f"=== ERROR: stream interrupted: {type(e).__name__}: {str(e)} ===")
+            yield sse_event('error', {'error': f'Upstream stream interrupted: {str(e)}'})
+            return
+        finally:
+            response.close()
+
+        content = ''.join(parts)
+        elapsed = time.perf_counter() - t0
+        print(f"=== Stream finished: first token {first or 0:.2f} s, total {elapsed:.2f} s, "
+              f"{len(parts)} chunks, {len(content)} chars ===")
+        event = final_event(content)
+        if use_cache and (not articles or event.startswith(b'event: result')):
+            # 以非流式响应的格式写入缓存，两种入口可互相命中
+            text = json.dumps({'choices': [{'message': {'content': content}}]}, ensure_ascii=False)
+            RESPONSE_CACHE.set(cache_key, {'status': 200, 'text': text, 'seconds': elapsed})
+            _record_cache_use('misses', 0.0)
+        yield event
+
+    return generate()
+
+
+# ========== 异步入口：单实例多并发时，在途的模型调用不再各占一个线程 ==========
+# 入口 index.async_handler，供支持协程入口的运行时（或自建的 asyncio 服务）调用；
+# 事件解析、来源校验、响应缓存、大批量拆分与响应格式都与 handler 相同。
+# 上游经每个事件循环共享的 httpx.AsyncClient（按 ASYNC_POOL_SHARD_SIZE 分片）调用，UPSTREAM_ASYNC_MAX_CONNECTIONS
+# 为连接总上限（默认 100）；客户端在事件循环关闭时一并关闭；
+# 未安装 httpx 时退回线程池调用同步连接池，结果一致，但每个在途请求仍占一个线程。
+UPSTREAM_ASYNC_MAX_CONNECTIONS = int(os.environ.get('UPSTREAM_ASYNC_MAX_CONNECTIONS', '100'))
+ASYNC_POOL_SHARD_SIZE = 32
+# AsyncClient 只能在创建它的事件循环中使用
+_async_clients = weakref.WeakKeyDictionary()
+_async_state = {'in_flight': 0, 'peak': 0}
+# 进行中的请求：(事件循环, 缓存键) -> {"done", "result", "error"}
+_async_inflight = {}
+
+
+async def _close_with_loop(loop, clients):
+    # 事件循环关闭前（asyncio.run 结束时）会调用 shutdown_asyncgens()，对尚未结束的异步生成器执行 aclose()，
+    # 借此在循环仍可用时关闭客户端，释放连接；否则每次 asyncio.run 都会遗留一批套接字
+    try:
+        yield
+    finally:
+        _async_clients.pop(loop, None)
+        for client in clients:
+            await client.aclose()
+
+
+async def _pick_async_client():
+    """返回 (分片序号, 当前事件循环的客户端分片)"""
+    loop = asyncio.get_running_loop()
+    pools = _async_clients.get(loop)
+    if pools is None:
+        # httpcore 的连接池每次分配请求都要按连接数平方扫描空闲连接，单池上百个连接时 CPU 成为瓶颈；
+        # 拆成若干个不超过 ASYNC_POOL_SHARD_SIZE 的小池
+        shards = max(1, -(-UPSTREAM_ASYNC_MAX_CONNECTIONS // ASYNC_POOL_SHARD_SIZE))
+        per_shard = -(-UPSTREAM_ASYNC_MAX_CONNECTIONS // shards)
+        ssl_context = httpx.create_ssl_context()  # 各分片共用，避免重复加载 CA 证书
+        clients = [
+            # 传入 transport 时 AsyncClient 的 limits 参数不生效，连接上限须设在 transport 上
+            httpx.AsyncClient(transport=httpx.AsyncHTTPTransport(
+                verify=ssl_context,
+                retries=2,  # 只重试建连失败
+                # httpx 默认空闲 5 秒即断开，请求稀疏的热实例几乎无法复用；放宽到 60 秒
+                limits=httpx.Limits(max_connections=per_shard, max_keepalive_connections=per_shard, keepalive_expiry=60),
+            ))
+            for _ in range(shards)
+        ]
+        lifetime = _close_with_loop(loop, clients)
+        # 事件循环只弱引用异步生成器，须由 pools 持有
+        pools = _async_clients[loop] = {'clients': clients, 'active': [0] * shards, 'lifetime': lifetime}
+        await lifetime.__anext__()
+    # 选在途请求最少的分片，相同时取靠前的：低并发时总用第一个分片，热连接得以复用
+    active = pools['active']
+    shard = active.index(min(active))
+    return shard, pools
+
+
+async def post_upstream_async(payload, req_headers, timeout=120):
+    """异步调用上游，返回 {"status", "text", "seconds", "source"}；带 Retry-After 的限流重试一次，与同步连接池一致"""
+    if httpx is None:
+        return await asyncio.to_thread(_call_upstream, payload, req_headers, timeout)
+
+    t0 = time.perf_counter()
+    _async_state['in_flight'] += 1
+    _async_state['peak'] = max(_async_state['peak'], _async_state['in_flight'])
+    shard, pools = await _pick_async_client()
+    pools['active'][shard] += 1
     try:
-        print(f"=== Calling 302.ai API ===")
-        print(f"Model: {model}")
-        print(f"Messages count: {len(messages)}")
+        for attempt in range(2):
+            response = await pools['clients'][shard].post(API_URL, headers=req_headers, json=payload, timeout=timeout)
+            retry_after = response.headers.get('Retry-After', '').strip()
+            if response.status_code not in UPSTREAM_RETRY_STATUS or not retry_after or attempt == 1:
+                break
+            await asyncio.sleep(float(retry_after) if retry_after.isdigit() else 0.5)
+    finally:
+        in_flight = _async_state['in_flight']  # 含本请求，须在递减前读取
+        pools['active'][shard] -= 1
+        _async_state['in_flight'] -= 1
+    seconds = time.perf_counter() - t0
+    with _stats_lock:
+        _stats['calls'] += 1
+        calls = _stats['calls']
+    print(
+        f"=== Upstream timing (async): model {seconds:.2f} s, in flight {in_flight}, "
+        f"peak {_async_state['peak']}, instance calls {calls} ==="
+    )
+    return {'status': response.status_code, 'text': response.text, 'seconds': seconds, 'source': 'upstream'}
+
+
+async def _cache_call(method, *args):
+    # 内存缓存直接调用；文件与 Redis 后端是阻塞 I/O，放到线程里执行
+    if isinstance(RESPONSE_CACHE, MemoryResponseCache):
+        return method(*args)
+    return await asyncio.to_thread(method, *args)
+
 
-        response = requests.post(API_URL, headers=req_headers, json=payload, timeout=120)
+async def cached_completion_async(payload, req_headers, timeout=120, use_cache=True, validate=None):
+    """cached_completion 的异步版本：同一事件循环内的相同请求合并为一次上游调用"""
+    if RESPONSE_CACHE is None or not use_cache:
+        return await post_upstream_async(payload, req_headers, timeout)
+
+    key = response_cache_key(payload)
+    entry = await _cache_call(RESPONSE_CACHE.get, key)
+    if entry is not None:
+        _record_cache_use('hits', entry['seconds'])
+        return {'status': entry['status'], 'text': entry['text'], 'seconds': entry['seconds'], 'source': 'cache'}
+
+    flight_key = (asyncio.get_running_loop(), key)
+    flight = _async_inflight.get(flight_key)
+    while flight is not None:
+        await flight['done'].wait()
+        if flight['error'] is not None:
+            raise flight['error']
+        if flight['result'] is not None:
+            result = flight['result']
+            _record_cache_use('coalesced', result['seconds'])
+            return dict(result, source='coalesced')
+        # 发起者被取消：重新检查，没有新的发起者时由本请求接手调用上游
+        flight = _async_inflight.get(flight_key)
+
+    flight = _async_inflight[flight_key] = {'done': asyncio.Event(), 'result': None, 'error': None}
+    try:
+        result = await post_upstream_async(payload, req_headers, timeout)
+        _record_cache_use('misses', 0.0)
+        if 200 <= result['status'] < 300 and (validate is None or validate(result['text'])):
+            entry = {'status': result['status'], 'text': result['text'], 'seconds': result['seconds']}
+            await _cache_call(RESPONSE_CACHE.set, key, entry)
+        flight['result'] = result
+    # 只把普通异常转交给等待者；被取消时 result 与 error 都为空，等待者醒来后自行重试
+    except Exception as e:
+        flight['error'] = e
+        raise
+    finally:
+        _async_inflight.pop(flight_key, None)
+        flight['done'].set()
+    return result
 
-        print(f"=== 302.ai Response Status: {response.status_code} ===")
-        print(f"=== Response length: {len(response.text)} bytes ===")
 
-        # 如果是批量摘要/洞察输入，尽力解析模型输出为目标结构
-        if articles and response.ok:
+async def summarize_fanout_async(body, articles, req_headers, use_cache=True):
+    """summarize_fanout 的异步版本：各块在同一事件循环上并发，FANOUT_CONCURRENCY 限制同时在途的块数"""
+    chunks = chunk_articles(articles)
+    limit = asyncio.Semaphore(max(1, FANOUT_CONCURRENCY))
+    print(f"=== Fan-out: {len(articles)} articles in {len(chunks)} calls, concurrency {min(FANOUT_CONCURRENCY, len(chunks))} ===")
+    t0 = time.perf_counter()
+
+    async def run(chunk):
+        ids, issue_id, payload, validate = _chunk_request(body, chunk)
+        async with limit:
             try:
-                data = response.json()
-                content = (
-                    data.get('choices', [{}])[0]
-                        .get('message', {})
-                        .get('content', '')
+                upstream = await cached_completion_async(
+                    payload, req_headers, timeout=120, use_cache=use_cache, validate=validate
                 )
-                # 模型可能在 JSON 外包裹 ```json ... ```，需要清理
-                content = content.strip()
-                if content.startswith('```json'):
-                    content = content[7:]  # 去掉开头的 ```json
-                if content.startswith('```'):
-                    content = content[3:]
-                if content.endswith('```'):
-                    content = content[:-3]
-                content = content.strip()
-                
-                parsed = json.loads(content)
-                # 简单校验
-                if isinstance(parsed, dict) and 'articles' in parsed:
-                    result = {
-                        'issueId': parsed.get('issueId') or (issue_id or 'unknown-issue'),
-                        'articles': [
-                            {
-                                'id': str(it.get('id', '')),
-                                'summary': it.get('summary', ''),
-                                'insight': it.get('insight', ''),
-                            }
-                            for it in parsed.get('articles', [])
-                        ]
-                    }
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': cors_origin,
-                            'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                            'Access-Control-Allow-Headers': 'Content-Type, Accept'
-                        },
-                        'body': json.dumps(result, ensure_ascii=False)
-                    }
-            except Exception as _:
-                # 解析失败时，回落为原始返回，便于排查 prompt
-                pass
-
-        # 其它情况：原样透传（保持你原来的行为）
-        return {
-            'statusCode': response.status_code,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': cors_origin,
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, Accept'
-            },
-            'body': response.text
-        }
-    except requests.exceptions.Timeout:
-        print("=== ERROR: Request timeout ===")
-        return {
-            'statusCode': 504,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': cors_origin,
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, Accept'
-            },
-            'body': json.dumps({'error': 'Request timeout after 120 seconds'})
-        }
+            except Exception as e:
+                return _chunk_outcome(ids, issue_id, error=e)
+        return _chunk_outcome(ids, issue_id, upstream)
+
+    outcomes = await asyncio.gather(*(run(chunk) for chunk in chunks))
+    return _merge_chunks(body, articles, outcomes, t0)
+
+
+async def async_handler(event, context):
+    early, request = parse_event(event)
+    if early is not None:
+        return early
+
+    if request['fanout']:
+        result = await summarize_fanout_async(
+            request['body'], request['articles'], request['req_headers'], use_cache=request['use_cache']
+        )
+        return fanout_response(result, request['cors_origin'])
+
+    try:
+        _log_call(request)
+        upstream = await cached_completion_async(
+            request['payload'], request['req_headers'], timeout=120,
+            use_cache=request['use_cache'], validate=_batch_validator(request),
+        )
+        return completion_response(upstream, request)
     except Exception as e:
-        print(f"=== ERROR: {type(e).__name__}: {str(e)} ===")
-        import traceback
-        print(f"=== Traceback: ===")
-        traceback.print_exc()
-        
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': cors_origin,
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, Accept'
-            },
-            'body': json.dumps({'error': f'Internal error: {str(e)}'})
-        }
\ No newline at end of file
+        return error_response(e, request['cors_origin'])
@@ -18,6 +18,9 @@ export const OSS_CONFIG = {
     issueDetail: (issueId: string) => `/data/issues/${issueId}.json`,  // 期次详情
     pdf: (issueId: string) => `/data/pdfs/${issueId}.pdf`,  // PDF 文件
     markdown: (issueId: string) => `/data/markdown/${issueId}.md`,  // Markdown（可选）
+    searchManifest: '/data/search/manifest.json',  // 检索索引清单
+    searchTitles: '/data/search/titles.json',  // 检索结果标题
+    searchShard: (shard: string) => `/data/search/${shard}.json`,  // 检索索引分片
   }
 }
 
@@ -0,0 +1,114 @@
+/**
+ * 全文检索模块
+ * 使用构建期预生成的倒排索引（tools/search_index.py），只拉取查询词所在的分片
+ */
+
+import { getOssUrl, OSS_CONFIG } from './oss-config'
+
+// 分词与分片规则须与 tools/search_index.py 保持一致
+const TOKEN_RUN_RE = /[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[a-z0-9]+/g
+const WORD_RE = /^[a-z0-9]+$/
+
+interface SearchManifest {
+  version: number
+  shards: number
+  issues: Record<string, string[]>
+}
+
+type SearchShard = Record<string, Record<string, number[]>>
+
+export interface SearchHit {
+  issueId: string
+  articleId: string // 与 issues/{issueId}.json 中的文章 id 一致
+  title: string
+  score: number
+}
+
+/**
+ * 分词：NFKC + 小写，汉字切二元组，字母数字串整体为一词
+ */
+export function tokenize(text: string): string[] {
+  const tokens: string[] = []
+  const runs = text.normalize('NFKC').toLowerCase().match(TOKEN_RUN_RE) || []
+  for (const run of runs) {
+    if (WORD_RE.test(run)) {
+      if (run.length > 1 || /^\d$/.test(run)) tokens.push(run)
+    } else if (run.length === 1) {
+      tokens.push(run)
+    } else {
+      for (let i = 0; i < run.length - 1; i++) tokens.push(run.slice(i, i + 2))
+    }
+  }
+  return tokens
+}
+
+function shardOf(term: string, shards: number): string {
+  return ((term.codePointAt(0) || 0) % shards).toString(16).padStart(2, '0')
+}
+
+let manifestPromise: Promise<SearchManifest | null> | null = null
+let titlesPromise: Promise<Record<string, string[]>> | null = null
+const shardCache = new Map<string, Promise<SearchShard>>()
+
+async function fetchJson<T>(path: string, fallback: T): Promise<T> {
+  try {
+    const response = await fetch(getOssUrl(path))
+    if (!response.ok) return fallback
+    return await response.json()
+  } catch (error) {
+    console.error('[Search] 加载失败:', path, error)
+    return fallback
+  }
+}
+
+function loadShard(shard: string): Promise<SearchShard> {
+  let p = shardCache.get(shard)
+  if (!p) {
+    p = fetchJson<SearchShard>(OSS_CONFIG.paths.searchShard(shard), {})
+    shardCache.set(shard, p)
+  }
+  return p
+}
+
+/**
+ * 检索文章：查询中的每个词项都须命中（AND），按各词项得分之和排序
+ */
+export async function searchArticles(query: string, limit = 50): Promise<SearchHit[]> {
+  const terms = Array.from(new Set(tokenize(query)))
+  if (terms.length === 0) return []
+
+  if (!manifestPromise) {
+    manifestPromise = fetchJson<SearchManifest | null>(OSS_CONFIG.paths.searchManifest, null)
+  }
+  const manifest = await manifestPromise
+  if (!manifest) return []
+
+  const shards = await Promise.all(terms.map((t) => loadShard(shardOf(t, manifest.shards))))
+  let scores = new Map<string, number>()
+  for (let i = 0; i < terms.length; i++) {
+    const next = new Map<string, number>()
+    for (const [issueId, flat] of Object.entries(shards[i][terms[i]] || {})) {
+      for (let k = 0; k < flat.length; k += 2) {
+        const key = `${issueId}-${flat[k]}`
+        if (i === 0 || scores.has(key)) {
+          next.set(key, (scores.get(key) || 0) + flat[k + 1])
+        }
+      }
+    }
+    scores = next
+  }
+
+  if (!titlesPromise) {
+    titlesPromise = fetchJson<Record<string, string[]>>(OSS_CONFIG.paths.searchTitles, {})
+  }
+  const titles = await titlesPromise
+  return Array.from(scores.entries())
+    .sort((a, b) => b[1] - a[1])
+    .slice(0, limit)
+    .map(([articleId, score]) => {
+      const cut = articleId.lastIndexOf('-')
+      const issueId = articleId.slice(0, cut)
+      const order = Number(articleId.slice(cut + 1))
+      return { issueId, articleId, title: titles[issueId]?.[order] || '', score }
+    })
+}
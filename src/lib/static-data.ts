@@ -14,6 +14,17 @@ export interface StaticIssue {
   articles: StaticArticle[]
 }
 
+/**
+ * 期次列表项（data/issues.json，由 tools/build_archive.py 生成）
+ */
+export interface StaticIssueSummary {
+  id: string
+  title: string
+  publishDate: string
+  coverImage: string // 第 1 页缩略图或第一张文章配图
+  articleCount: number
+}
+
 export interface StaticArticle {
   id: string
   title: string
@@ -28,7 +39,7 @@ export interface StaticArticle {
 /**
  * 从静态JSON文件加载期次列表
  */
-export async function loadIssues(): Promise<StaticIssue[]> {
+export async function loadIssues(): Promise<StaticIssueSummary[]> {
   try {
     const url = getOssUrl(OSS_CONFIG.paths.issues)
     console.log('[Static] 加载期次列表:', url)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+批量构建多期周刊，并生成全局期次列表 data/issues.json
+
+输入目录约定（与 input/ 目录一致）：
+  {input-dir}/{issueId}-outline.json
+  {input-dir}/{issueId}-part*.md
+  {input-dir}/{issueId}.pdf          （可选，仅用于生成 URL）
+
+每期调用 build_issue_from_md.py 的构建流程，多期之间用进程池并行；未识别的参数
+（如 --gemini-endpoint、--incremental）原样转交给每一期的构建。各期只暂存全文检索词项，
+全部构建完后一次合并进 data/search/，避免每期都在文件锁下改写整批分片。
+全部完成后扫描 {output-dir}/data/issues/*.json 生成精简的期次列表，只保留首页
+列表需要的字段（id、title、publishDate、coverImage、articleCount），按出版日期倒序，
+首页只需加载这一个小文件。
+
+用法示例：
+  python3 tools/build_archive.py --input-dir input --output-dir public --oss-base-url / --jobs 4 \
+      --gemini-endpoint https://... --incremental
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import build_issue_from_md
+from search_index import SEARCH_DIR, merge_pending_index
+
+ISSUES_INDEX_NAME = "issues.json"
+OUTLINE_SUFFIX = "-outline.json"
+
+
+def _natural_key(path: Path) -> List[Any]:
+    """part2 排在 part10 之前"""
+    return [int(t) if t.isdigit() else t for t in re.split(r"(\d+)", path.name)]
+
+
+def find_issues(input_dir: Path) -> List[Dict[str, Any]]:
+    """按 {issueId}-outline.json 识别期次，返回 [{"id", "outline", "md_files", "pdf"}, ...]"""
+    issues = []
+    for outline_path in sorted(input_dir.glob(f"*{OUTLINE_SUFFIX}")):
+        issue_id = outline_path.name[: -len(OUTLINE_SUFFIX)]
+        md_files = sorted(input_dir.glob(f"{issue_id}-part*.md"), key=_natural_key)
+        if not md_files:
+            print(f"[WARN] {issue_id}: 未找到 {issue_id}-part*.md，跳过")
+            continue
+        issues.append({
+            "id": issue_id,
+            "outline": outline_path,
+            "md_files": md_files,
+            "pdf": input_dir / f"{issue_id}.pdf",
+        })
+    return issues
+
+
+def _build_one(argv: List[str]) -> Tuple[str, float]:
+    """子进程入口：构建一期，返回 (issue JSON 路径, 耗时)"""
+    t0 = time.perf_counter()
+    issue_path = build_issue_from_md.main(argv)
+    return str(issue_path), time.perf_counter() - t0
+
+
+def issue_cover(issue: Dict[str, Any], pages_dir: Path) -> str:
+    """列表封面：优先用渲染好的第 1 页（取最小宽度档），否则用第一张文章配图"""
+    manifest_path = pages_dir / issue["id"] / "manifest.json"
+    if manifest_path.exists():
+        try:
+            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+            tiers = manifest.get("tiers") or [{"images": manifest.get("images", [])}]
+            images = tiers[0].get("images") or manifest.get("images", [])
+            if images:
+                return f"/data/pages/{issue['id']}/{images[0]}"
+        except Exception as e:
+            print(f"[WARN] {issue['id']}: 无法读取 manifest.json - {e}")
+    return next((a["coverImage"] for a in issue.get("articles", []) if a.get("coverImage")), "")
+
+
+def build_issues_index(data_dir: Path) -> List[Dict[str, Any]]:
+    """扫描 data/issues/*.json，生成按出版日期倒序的精简期次列表"""
+    entries = []
+    for path in (data_dir / "issues").glob("*.json"):
+        try:
+            issue = json.loads(path.read_text(encoding="utf-8"))
+        except Exception as e:
+            print(f"[WARN] 跳过无法解析的 {path.name}: {e}")
+            continue
+        entries.append({
+            "id": issue.get("id") or path.stem,
+            "title": issue.get("title", ""),
+            "publishDate": issue.get("publishDate", ""),
+            "coverImage": issue_cover(issue, data_dir / "pages"),
+            "articleCount": len(issue.get("articles", [])),
+        })
+    entries.sort(key=lambda e: (e["publishDate"], e["id"]), reverse=True)
+    return entries
+
+
+def write_issues_index(data_dir: Path) -> Path:
+    entries = build_issues_index(data_dir)
+    index_path = data_dir / ISSUES_INDEX_NAME
+    tmp = index_path.with_name(index_path.name + ".tmp")
+    tmp.write_text(json.dumps(entries, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+    os.replace(tmp, index_path)
+    print(f"[INFO] 期次列表已保存: {index_path}（{len(entries)} 期，{index_path.stat().st_size / 1024:.1f} KB）")
+    return index_path
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="批量构建多期周刊并生成 data/issues.json；其余参数原样传给 build_issue_from_md.py"
+    )
+    parser.add_argument("--input-dir", default="input", help="期次输入目录（默认 input）")
+    parser.add_argument("--output-dir", required=True, help="输出目录，与 build_issue_from_md.py 相同")
+    parser.add_argument("--oss-base-url", required=True, help="OSS 基础 URL")
+    parser.add_argument("--issues", default="", help="只构建这些期次（逗号分隔），期次列表仍包含全部已构建期次")
+    parser.add_argument("--jobs", type=int, default=0, help="并行构建的进程数，0 表示 CPU 核数")
+    parser.add_argument("--index-only", action="store_true", help="不构建，只重新生成 issues.json")
+    args, passthrough = parser.parse_known_args(argv)
+
+    out_dir = Path(args.output_dir)
+    data_dir = out_dir / "data"
+
+    if not args.index_only:
+        wanted = {s.strip() for s in args.issues.split(",") if s.strip()}
+        issues = [i for i in find_issues(Path(args.input_dir)) if not wanted or i["id"] in wanted]
+        if not issues:
+            raise SystemExit(f"未在 {args.input_dir} 下找到 *{OUTLINE_SUFFIX}")
+        jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+        print(f"[INFO] 共 {len(issues)} 期待构建，{jobs} 进程")
+
+        t0 = time.perf_counter()
+        failed = []
+        with ProcessPoolExecutor(max_workers=min(jobs, len(issues))) as pool:
+            futures = {}
+            for issue in issues:
+                issue_argv = [
+                    "--issue-id", issue["id"],
+                    "--pdf", issue["pdf"].as_posix(),
+                    "--md-files", *[p.as_posix() for p in issue["md_files"]],
+                    "--outline", issue["outline"].as_posix(),
+                    "--output-dir", args.output_dir,
+                    "--oss-base-url", args.oss_base_url,
+                    "--defer-search-index",
+                    *passthrough,
+                ]
+                futures[pool.submit(_build_one, issue_argv)] = issue["id"]
+            for fut in as_completed(futures):
+                issue_id = futures[fut]
+                try:
+                    _, elapsed = fut.result()
+                    print(f"[INFO] ✅ {issue_id} 构建完成，耗时 {elapsed:.1f}s")
+                except (Exception, SystemExit) as e:
+                    # argparse 报错、outline 格式错误会以 SystemExit 抛出
+                    failed.append(issue_id)
+                    print(f"[WARN] ❌ {issue_id} 构建失败 - {e!r}")
+        print(f"[INFO] 批量构建结束：成功 {len(issues) - len(failed)} 期，失败 {len(failed)} 期，"
+              f"耗时 {time.perf_counter() - t0:.1f}s")
+
+        stats = merge_pending_index(data_dir / SEARCH_DIR)
+        if stats:
+            print(
+                f"[INFO] 检索索引已合并 {stats['issues']} 期：{stats['terms']} 个词项、{stats['postings']} 条倒排，"
+                f"改写 {stats['shards']} 个分片（{stats['bytes'] / 1024:.0f} KB）"
+            )
+
+    write_issues_index(data_dir)
+
+
+if __name__ == "__main__":
+    main()
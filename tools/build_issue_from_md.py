@@ -7,13 +7,19 @@
 """
 
 import argparse
+import hashlib
 import json
 import os
+import random
 import re
+import sqlite3
 import sys
 import textwrap
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from email.utils import formatdate
 
 try:
@@ -21,6 +27,16 @@ try:
 except Exception:
     requests = None
 
+from search_index import DEFAULT_SHARDS, SEARCH_DIR, article_terms, merge_issue_index, stage_issue_index
+
+try:
+    # process.cdist 依赖 numpy
+    import numpy  # noqa: F401
+    from rapidfuzz import fuzz, process as fuzz_process
+except Exception:
+    fuzz = None
+    fuzz_process = None
+
 
 # ========== 工具函数 ==========
 
@@ -73,106 +89,265 @@ def extract_disclaimer(text: str) -> Tuple[str, Optional[str]]:
 
 # ========== Markdown 解析 ==========
 
-def parse_markdown_by_outline(
-    md_text: str, outline_titles: List[str]
-) -> Dict[str, Dict[str, Optional[str]]]:
-    """使用 outline 中的标题精确切分 Markdown
-    
-    返回: {normalized_title: {"content": str, "image": str, "disclaimer": str}}
+def heading_key(s: str) -> str:
+    """标题查找键：标准化后去掉全部空格"""
+    return normalize_title(s).replace(" ", "")
+
+
+def iter_markdown_lines(paths: List[str]) -> Iterator[Tuple[int, str, str]]:
+    """逐行读取多个 MD 文件，等价于遍历以空行（"\n\n"）拼接后的全文
+
+    yield (行起点在全文中的偏移, 行文本（含换行符）, 所在文件)；任何时刻只持有一行。
     """
-    all_matches = list(MD_H_RE.finditer(md_text))
-    outline_norm = [normalize_title(t) for t in outline_titles]
-
-    def best_match(title: str) -> Optional[str]:
-        t = normalize_title(title)
-        t_comp = t.replace(" ", "")
-        for o in outline_norm:
-            if t == o or t_comp == o.replace(" ", ""):
-                return o
-        return None
+    def pieces() -> Iterator[Tuple[str, str]]:
+        for i, path in enumerate(paths):
+            if i:
+                yield "\n\n", paths[i - 1]
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    yield line, path
 
-    # 收集匹配的标题位置
-    matched: List[Tuple[int, str]] = []
-    for m in all_matches:
-        title = m.group(1)
-        o = best_match(title)
-        if o:
-            matched.append((m.start(), o))
+    offset = 0
+    carry = ""
+    carry_file = ""
+    for piece, path in pieces():
+        if not carry:
+            carry_file = path
+        carry += piece
+        nl = carry.find("\n")
+        while nl >= 0:
+            line = carry[:nl + 1]
+            yield offset, line, carry_file
+            offset += len(line)
+            carry = carry[nl + 1:]
+            carry_file = path
+            nl = carry.find("\n")
+    if carry:
+        yield offset, carry, carry_file
 
-    # 去重并排序
-    seen = set()
-    matched_sorted = []
-    for pos, t in sorted(matched, key=lambda x: x[0]):
-        if t in seen:
+
+def build_heading_index(paths: List[str]) -> Dict[str, Any]:
+    """流式遍历全部 MD 文件一次，只记录标题，建立标题索引
+
+    返回:
+      {
+        "headings": [{"start", "body", "level", "key", "file"}, ...],  # 按出现顺序
+        "by_key": {标题查找键: [headings 下标, ...]},
+        "length": 合并后全文长度,
+      }
+    start 为标题行起点，body 为标题行之后的正文起点，均为合并后全文的偏移。
+    """
+    headings: List[Dict[str, Any]] = []
+    by_key: Dict[str, List[int]] = {}
+    length = 0
+    for offset, line, path in iter_markdown_lines(paths):
+        length = offset + len(line)
+        m = MD_H_RE.match(line.rstrip("\n"))
+        if not m:
             continue
-        seen.add(t)
-        matched_sorted.append((pos, t))
+        key = heading_key(m.group(1))
+        by_key.setdefault(key, []).append(len(headings))
+        headings.append({
+            "start": offset,
+            "body": length,
+            "level": len(m.group(0)) - len(m.group(0).lstrip("#")),
+            "key": key,
+            "file": path,
+        })
+    return {"headings": headings, "by_key": by_key, "length": length}
 
-    # 构建切片
-    sections: Dict[str, Dict[str, Optional[str]]] = {}
-    for i, (start, t) in enumerate(matched_sorted):
-        end = matched_sorted[i + 1][0] if i + 1 < len(matched_sorted) else len(md_text)
-        body = md_text[start:end]
-        # 去掉标题行
-        m = MD_H_RE.match(body.splitlines()[0])
-        if m:
-            body = body[body.find("\n") + 1:]
-
-        img_m = IMG_RE.search(body) or MD_IMG_RE.search(body)
-        img_url = img_m.group(1) if img_m else None
-        cleaned, disclaimer = extract_disclaimer(body)
-        sections[t] = {"content": cleaned, "image": img_url, "disclaimer": disclaimer}
 
+def iter_section_bodies(
+    paths: List[str], spans: List[Dict[str, Any]]
+) -> Iterator[Tuple[int, str]]:
+    """第二遍流式读取，按 spans（{"start", "end"} 全文偏移，均落在行首）切出正文
+
+    每个 span 读完即 yield (spans 下标, 正文)，只缓存尚未读完的 span。
+    """
+    order = sorted(range(len(spans)), key=lambda i: spans[i]["start"])
+    active: Dict[int, List[str]] = {}
+    ptr = 0
+    for offset, line, _ in iter_markdown_lines(paths):
+        for i in [i for i in active if spans[i]["end"] <= offset]:
+            yield i, "".join(active.pop(i))
+        while ptr < len(order) and spans[order[ptr]]["start"] <= offset:
+            active[order[ptr]] = []
+            ptr += 1
+        for buf in active.values():
+            buf.append(line)
+    for i in list(active):
+        yield i, "".join(active.pop(i))
+    # 起点在全文末尾的 span（标题是最后一行）正文为空
+    for i in order[ptr:]:
+        yield i, ""
+
+
+def _section_from_body(body: str) -> Dict[str, Optional[str]]:
+    img_m = IMG_RE.search(body) or MD_IMG_RE.search(body)
+    img_url = img_m.group(1) if img_m else None
+    cleaned, disclaimer = extract_disclaimer(body)
+    return {"content": cleaned, "image": img_url, "disclaimer": disclaimer}
+
+
+def fuzzy_match_headings(
+    index: Dict[str, Any],
+    outline_titles: List[str],
+    assigned: Dict[int, str],
+    threshold: float,
+) -> List[Tuple[int, str, float]]:
+    """对精确匹配后剩余的 outline 标题与 Markdown 标题做模糊匹配（OCR 错字、漏字）
+
+    一次 process.cdist 计算全部得分，按得分从高到低分配，且须与已匹配的标题保持
+    outline 顺序（outline 靠前的文章，其标题在 Markdown 中也靠前）。
+    assigned: {headings 下标: 标准化标题}，为已确定的匹配。
+    返回: [(headings 下标, 标准化标题, 得分), ...]
+    """
+    if fuzz_process is None:
+        return []
+    headings = index["headings"]
+    norm = [normalize_title(t) for t in outline_titles]
+    first_idx: Dict[str, int] = {}
+    for i, t in enumerate(norm):
+        first_idx.setdefault(t, i)
+    done_titles = set(assigned.values())
+    pending = [i for t, i in first_idx.items() if t not in done_titles]
+    free = [hi for hi in range(len(headings)) if hi not in assigned]
+    if not pending or not free:
+        return []
+
+    scores = fuzz_process.cdist(
+        [heading_key(outline_titles[i]) for i in pending],
+        [headings[hi]["key"] for hi in free],
+        scorer=fuzz.ratio,
+        score_cutoff=threshold,
+        workers=-1,
+    )
+    rows, cols = scores.nonzero()
+    candidates = sorted(
+        ((float(scores[r, c]), pending[r], free[c]) for r, c in zip(rows, cols)),
+        key=lambda x: (-x[0], x[1], x[2]),
+    )
+
+    # 顺序约束的锚点：(outline 序号, 标题下标)
+    anchors = [(first_idx[o], hi) for hi, o in assigned.items()]
+    used_o = set()
+    used_h = set()
+    result: List[Tuple[int, str, float]] = []
+    for score, oi, hi in candidates:
+        if oi in used_o or hi in used_h:
+            continue
+        if any((oi < ao) != (hi < ah) for ao, ah in anchors):
+            continue
+        anchors.append((oi, hi))
+        used_o.add(oi)
+        used_h.add(hi)
+        result.append((hi, norm[oi], score))
+    return result
+
+
+def match_outline_sections(
+    index: Dict[str, Any],
+    outline_titles: List[str],
+    fuzzy_threshold: float = 0.0,
+    fuzzy_report: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """使用 outline 中的标题切分 Markdown（只看标题索引，不读正文）
+
+    先按标题查找键精确匹配；fuzzy_threshold > 0 时再对剩余标题做模糊匹配
+    （见 fuzzy_match_headings），匹配结果追加到 fuzzy_report。
+
+    返回: {normalized_title: {"start": int, "end": int, "file": str}}，正文由 iter_section_bodies 读取
+    """
+    headings = index["headings"]
+    # 查找键 -> 标准化标题；同键取 outline 中最先出现的
+    outline_by_key: Dict[str, str] = {}
+    for t in outline_titles:
+        outline_by_key.setdefault(heading_key(t), normalize_title(t))
+
+    # 按出现顺序收集匹配的标题，同一篇只取第一次出现
+    seen = set()
+    assigned: Dict[int, str] = {}
+    for hi, h in enumerate(headings):
+        o = outline_by_key.get(h["key"])
+        if o and o not in seen:
+            seen.add(o)
+            assigned[hi] = o
+
+    if fuzzy_threshold > 0:
+        for hi, o, score in fuzzy_match_headings(index, outline_titles, assigned, fuzzy_threshold):
+            assigned[hi] = o
+            if fuzzy_report is not None:
+                fuzzy_report.append({"title": o, "heading": headings[hi]["key"], "score": score})
+
+    # 构建切片
+    matched = sorted(assigned.items())
+    sections: Dict[str, Dict[str, Any]] = {}
+    for i, (hi, t) in enumerate(matched):
+        end = headings[matched[i + 1][0]]["start"] if i + 1 < len(matched) else index["length"]
+        sections[t] = {"start": headings[hi]["body"], "end": end, "file": headings[hi]["file"]}
     return sections
 
 
 def manual_find_section(
-    md_text: str, target_title: str, outline_titles: List[str]
-) -> Optional[Dict[str, Optional[str]]]:
-    """兜底策略：手动查找包含目标标题的段落，切到下一个 outline 标题为止"""
-    lines = md_text.splitlines()
-    headings: List[Tuple[int, str]] = []
-    for idx, ln in enumerate(lines):
-        if ln.startswith("## "):
-            t = ln[3:].strip()
-            headings.append((idx, normalize_title(t)))
-
-    target_n = normalize_title(target_title).replace(" ", "")
-    outline_norm = [normalize_title(t).replace(" ", "") for t in outline_titles]
-
-    # 找起点
-    start_line = None
-    for i, (idx, t) in enumerate(headings):
-        if t.replace(" ", "") == target_n or target_n in t.replace(" ", ""):
-            start_line = idx
-            start_pos = i
-            break
-    if start_line is None:
+    index: Dict[str, Any], target_title: str, outline_titles: List[str]
+) -> Optional[Dict[str, Any]]:
+    """兜底策略：查找包含目标标题的二级标题，切到下一个 outline 标题为止
+
+    返回格式同 match_outline_sections 的单项。
+    """
+    headings = [(i, h) for i, h in enumerate(index["headings"]) if h["level"] == 2]
+    target_n = heading_key(target_title)
+    outline_keys = {heading_key(t) for t in outline_titles}
+
+    # 找起点：先按键精确查找，再退回标题子串匹配
+    start_pos = None
+    exact = [i for i in index["by_key"].get(target_n, []) if index["headings"][i]["level"] == 2]
+    if exact:
+        start_pos = next(pos for pos, (i, _) in enumerate(headings) if i == exact[0])
+    else:
+        start_pos = next((pos for pos, (_, h) in enumerate(headings) if target_n in h["key"]), None)
+    if start_pos is None:
         return None
 
     # 找终点：下一个在 outline 中的标题
-    end_line = len(lines)
-    for j in range(start_pos + 1, len(headings)):
-        _, next_t = headings[j]
-        if next_t.replace(" ", "") in outline_norm:
-            end_line = headings[j][0]
+    end = index["length"]
+    for _, h in headings[start_pos + 1:]:
+        if h["key"] in outline_keys:
+            end = h["start"]
             break
 
-    body = "\n".join(lines[start_line + 1 : end_line])
-    img_m = IMG_RE.search(body) or MD_IMG_RE.search(body)
-    img_url = img_m.group(1) if img_m else None
-    cleaned, disclaimer = extract_disclaimer(body)
-    return {"content": cleaned, "image": img_url, "disclaimer": disclaimer}
+    start_h = headings[start_pos][1]
+    return {"start": start_h["body"], "end": end, "file": start_h["file"]}
 
 
 # ========== Gemini 调用 ==========
 
+# 视为暂时性故障、值得重试的 HTTP 状态码（限流、网关/上游过载）
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# 批量过大时的典型失败（网关超时、请求体过大）：重试用尽后对半拆分仍有机会挽救
+SPLIT_STATUS = {413, 504}
+
+
+class GeminiError(RuntimeError):
+    """云函数调用失败
+
+    transient 为真表示网络或过载等暂时性故障，可重试；splittable 为真表示失败可能源于
+    批量过大（超时、504、413、返回格式异常），拆成小批重发有望成功。鉴权等永久性错误两者皆否。
+    """
+
+    def __init__(self, message: str, transient: bool = False, splittable: bool = False):
+        super().__init__(message)
+        self.transient = transient
+        self.splittable = splittable
+
+
 def call_gemini(
     endpoint: str,
     issue_id: str,
     articles: List[Dict[str, Any]],
     api_key: Optional[str] = None,
     prompt: Optional[str] = None,
+    model: Optional[str] = None,
 ) -> Dict[str, Any]:
     """调用 Gemini 云函数生成摘要和洞察"""
     if not requests:
@@ -188,22 +363,286 @@ def call_gemini(
     payload: Dict[str, Any] = {"issueId": issue_id, "articles": articles}
     if prompt:
         payload["prompt"] = prompt
+    if model:
+        payload["model"] = model
     
     # 增加超时时间到 300 秒（5分钟），避免处理大批量文章时超时
-    resp = requests.post(endpoint, headers=headers, json=payload, timeout=300)
+    try:
+        resp = requests.post(endpoint, headers=headers, json=payload, timeout=300)
+    except requests.Timeout as e:
+        raise GeminiError(f"Gemini endpoint timed out: {e}", transient=True, splittable=True) from e
+    except requests.ConnectionError as e:
+        raise GeminiError(f"Gemini endpoint unreachable: {e}", transient=True) from e
     
     try:
         resp.raise_for_status()
     except Exception as e:
         body = resp.text[:2000] if hasattr(resp, "text") else "<no body>"
-        raise RuntimeError(f"Gemini endpoint error {resp.status_code}: {body}") from e
+        raise GeminiError(
+            f"Gemini endpoint error {resp.status_code}: {body}",
+            transient=resp.status_code in RETRY_STATUS,
+            splittable=resp.status_code in SPLIT_STATUS,
+        ) from e
     
-    return resp.json()
+    try:
+        return resp.json()
+    except ValueError as e:
+        raise GeminiError(f"Gemini 返回非 JSON 内容: {resp.text[:500]}", splittable=True) from e
+
+
+def call_gemini_with_retry(
+    endpoint: str,
+    issue_id: str,
+    articles: List[Dict[str, Any]],
+    api_key: Optional[str] = None,
+    prompt: Optional[str] = None,
+    model: Optional[str] = None,
+    retries: int = 3,
+    base_delay: float = 2.0,
+    max_delay: float = 60.0,
+) -> Dict[str, Any]:
+    """暂时性故障按指数退避重试（full jitter：等待 0 ~ base_delay × 2^n 秒间的随机值）"""
+    for attempt in range(retries + 1):
+        try:
+            return call_gemini(endpoint, issue_id, articles, api_key, prompt, model)
+        except GeminiError as e:
+            if not e.transient or attempt >= retries:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            print(f"[WARN] {e}；{delay:.1f}s 后第 {attempt + 1}/{retries} 次重试")
+            time.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+def summarize_batch(
+    endpoint: str,
+    issue_id: str,
+    articles: List[Dict[str, Any]],
+    api_key: Optional[str] = None,
+    prompt: Optional[str] = None,
+    model: Optional[str] = None,
+    retries: int = 3,
+    base_delay: float = 2.0,
+) -> Dict[str, Any]:
+    """处理一批文章，尽量挽救部分结果
+
+    返回中 id 属于本批且 summary 非空的文章直接收下；部分文章缺失时把缺失的文章作为
+    新的一批重发；超时、504、413 在重试用尽后，或返回格式异常、一篇都没返回时，对半
+    拆分后分别重发，直到单篇为止。鉴权失败（401/403）等永久性错误与网络不通时整批
+    记为失败，不再拆分——拆开只会多出一串注定失败的请求。
+    返回: {"articles": {id: 结果}, "failed": {id: 错误信息}, "requests": 请求次数, "seconds": 耗时}
+    """
+    t0 = time.perf_counter()
+    results: Dict[str, Dict[str, Any]] = {}
+    failed: Dict[str, str] = {}
+    n_requests = 0
+
+    def run(part: List[Dict[str, Any]]) -> None:
+        nonlocal n_requests
+        n_requests += 1
+        error = ""
+        splittable = False
+        try:
+            resp = call_gemini_with_retry(endpoint, issue_id, part, api_key, prompt, model, retries, base_delay)
+            if not isinstance(resp.get("articles"), list):
+                raise GeminiError(
+                    f"Gemini 返回格式异常，缺少 articles 字段: {json.dumps(resp, ensure_ascii=False)[:500]}",
+                    splittable=True,
+                )
+            wanted = {a["id"] for a in part}
+            for a in resp["articles"]:
+                if isinstance(a, dict) and a.get("id") in wanted and a.get("summary"):
+                    results[a["id"]] = a
+        except Exception as e:
+            error = str(e)
+            splittable = isinstance(e, GeminiError) and e.splittable
+        missing = [a for a in part if a["id"] not in results]
+        if not missing:
+            return
+        if len(part) == 1 or (error and not splittable):
+            for a in missing:
+                failed[a["id"]] = error or "返回结果中缺少该文章"
+            return
+        if not error and len(missing) < len(part):
+            # 有进展：只重发缺失的文章
+            run(missing)
+            return
+        # 对半拆分后重发未完成的文章
+        if error:
+            print(f"[WARN] {len(part)} 篇文章的请求失败，拆分重试：{error[:200]}")
+        mid = len(missing) // 2
+        run(missing[:mid])
+        run(missing[mid:])
+
+    run(articles)
+    return {
+        "articles": results,
+        "failed": failed,
+        "requests": n_requests,
+        "seconds": time.perf_counter() - t0,
+    }
+
+
+# ========== AI 请求分批 ==========
+
+# 中日韩字符及全角标点按 1 字 1 token 估算，其余按 4 字符 1 token
+CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+# 每篇文章在请求中的固定开销（id、字段名、JSON 结构）
+ARTICLE_OVERHEAD_TOKENS = 30
+
+
+def estimate_tokens(text: str) -> int:
+    cjk = len(CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def pack_ai_batches(
+    items: List[Dict[str, Any]],
+    input_budget: int,
+    output_budget: int,
+    output_per_article: int,
+) -> List[Dict[str, Any]]:
+    """按 token 预算把文章装入若干请求批次（最长优先、首次适应）
+
+    每批输入估算不超过 input_budget、输出估算（篇数 × output_per_article）不超过
+    output_budget；单篇超出预算时独占一批。批次按创建顺序返回，含最长文章的批次在前，
+    先提交可缩短尾部延迟。
+    返回: [{"articles": [...], "inputTokens": int, "outputTokens": int}, ...]
+    """
+    costed = sorted(
+        ((estimate_tokens(a["title"]) + estimate_tokens(a["content"]) + ARTICLE_OVERHEAD_TOKENS, a) for a in items),
+        key=lambda x: -x[0],
+    )
+    batches: List[Dict[str, Any]] = []
+    for cost, a in costed:
+        for b in batches:
+            if b["inputTokens"] + cost <= input_budget and b["outputTokens"] + output_per_article <= output_budget:
+                break
+        else:
+            b = {"articles": [], "inputTokens": 0, "outputTokens": 0}
+            batches.append(b)
+        b["articles"].append(a)
+        b["inputTokens"] += cost
+        b["outputTokens"] += output_per_article
+    return batches
+
+
+# ========== AI 结果缓存 ==========
+
+# 云函数未指定 model 时使用的默认模型（与 caixin_index.py 保持一致），参与缓存键计算
+DEFAULT_MODEL = "gemini-2.5-pro"
+AI_CACHE_PATH = ".cache/ai-summaries.sqlite"
+
+
+def ai_cache_key(title: str, content: str, prompt: Optional[str], model: str) -> str:
+    """按 (标题, 正文, prompt, 模型) 计算缓存键；正文空白差异不影响命中"""
+    h = hashlib.sha1()
+    for part in (normalize_title(title), re.sub(r"\s+", " ", content).strip(), prompt or "", model):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def open_ai_cache(path: Path) -> Optional[sqlite3.Connection]:
+    """打开缓存库；打不开时告警并返回 None（不使用缓存）
+
+    归档批量构建时多个进程共用同一缓存文件：连接设为自动提交，每次写入立即提交、只短暂持有写锁，
+    并启用 WAL，读操作不被写入阻塞。缓存出错只告警，不影响构建。
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        conn = sqlite3.connect(path.as_posix(), timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            " key TEXT PRIMARY KEY, summary TEXT NOT NULL, insight TEXT NOT NULL,"
+            " size INTEGER NOT NULL, used REAL NOT NULL)"
+        )
+    except sqlite3.Error as e:
+        print(f"[WARN] 无法打开 AI 缓存 {path}，本次不使用缓存 - {e}")
+        return None
+    return conn
+
+
+def ai_cache_get(conn: sqlite3.Connection, key: str) -> Optional[Dict[str, str]]:
+    try:
+        row = conn.execute("SELECT summary, insight FROM summaries WHERE key = ?", (key,)).fetchone()
+        if not row:
+            return None
+        conn.execute("UPDATE summaries SET used = ? WHERE key = ?", (time.time(), key))
+    except sqlite3.OperationalError as e:
+        print(f"[WARN] AI 缓存读取失败，按未命中处理 - {e}")
+        return None
+    return {"summary": row[0], "insight": row[1]}
+
+
+def ai_cache_put(conn: sqlite3.Connection, key: str, summary: str, insight: str) -> None:
+    size = len(summary.encode("utf-8")) + len(insight.encode("utf-8"))
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO summaries (key, summary, insight, size, used) VALUES (?, ?, ?, ?, ?)",
+            (key, summary, insight, size, time.time()),
+        )
+    except sqlite3.OperationalError as e:
+        print(f"[WARN] AI 缓存写入失败 - {e}")
+
+
+def ai_cache_evict(conn: sqlite3.Connection, max_bytes: int) -> int:
+    """超出容量时按最近使用时间淘汰最旧条目，返回淘汰条数"""
+    try:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM summaries").fetchone()[0]
+        if total <= max_bytes:
+            return 0
+        evicted = 0
+        for key, size in conn.execute("SELECT key, size FROM summaries ORDER BY used").fetchall():
+            if total <= max_bytes:
+                break
+            conn.execute("DELETE FROM summaries WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+    except sqlite3.OperationalError as e:
+        print(f"[WARN] AI 缓存淘汰失败 - {e}")
+        return 0
+    return evicted
+
+
+# ========== 增量构建 ==========
+
+def article_content_hash(title: str, content: str) -> str:
+    """文章内容指纹（写入 issue JSON 的 contentHash），增量构建据此判断文章是否改动"""
+    h = hashlib.sha1()
+    h.update(normalize_title(title).encode("utf-8"))
+    h.update(b"\0")
+    h.update(re.sub(r"\s+", " ", content).strip().encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def load_previous_articles(issue_path: Path) -> Dict[str, Dict[str, Any]]:
+    """读取已有 issue JSON，返回 {contentHash: 文章}；只收录已有摘要的文章"""
+    if not issue_path.exists():
+        return {}
+    try:
+        data = json.loads(issue_path.read_text(encoding="utf-8"))
+    except Exception as e:
+        print(f"[WARN] 无法读取已有 issue JSON，按全量构建: {e}")
+        return {}
+    return {
+        a["contentHash"]: a
+        for a in data.get("articles", [])
+        if a.get("contentHash") and a.get("summary")
+    }
+
+
+def write_text_atomic(path: Path, text: str) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
 
 
 # ========== 主流程 ==========
 
-def main() -> None:
+def main(argv: Optional[List[str]] = None) -> Path:
+    """构建一期；argv 为空时读取命令行。返回写出的 issue JSON 路径"""
     parser = argparse.ArgumentParser(
         description="从 Markdown 文件构建财新周刊 issue JSON"
     )
@@ -218,7 +657,53 @@ def main() -> None:
     parser.add_argument("--gemini-endpoint", help="Gemini 云函数端点（可选）")
     parser.add_argument("--gemini-api-key", help="Gemini API Key（可选）")
     parser.add_argument("--prompt-file", help="Prompt 文件路径（可选）")
-    args = parser.parse_args()
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="同时发出的 Gemini 请求数上限（默认 4）"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="与已有 issue JSON 按文章内容指纹比对，只为新增或改动的文章调用 AI",
+    )
+    parser.add_argument(
+        "--no-search-index", action="store_true", help="不更新全文检索索引（data/search/）"
+    )
+    parser.add_argument(
+        "--search-shards", type=int, default=DEFAULT_SHARDS, help=f"检索索引分片数（默认 {DEFAULT_SHARDS}）"
+    )
+    parser.add_argument(
+        "--defer-search-index",
+        action="store_true",
+        help="只暂存本期检索词项（data/search/.pending/），由 build_archive.py 全部构建完后统一合并",
+    )
+    parser.add_argument(
+        "--fuzzy-threshold",
+        type=float,
+        default=85,
+        help="标题模糊匹配的最低得分（0-100，rapidfuzz ratio），0 表示关闭（默认 85）",
+    )
+    parser.add_argument(
+        "--batch-input-tokens", type=int, default=30000, help="单次 AI 请求的输入 token 预算（估算值，默认 30000）"
+    )
+    parser.add_argument(
+        "--batch-output-tokens", type=int, default=8000, help="单次 AI 请求的输出 token 预算（估算值，默认 8000）"
+    )
+    parser.add_argument(
+        "--output-tokens-per-article", type=int, default=700, help="每篇文章 summary+insight 的输出 token 估算（默认 700）"
+    )
+    parser.add_argument(
+        "--retries", type=int, default=3, help="网络错误、429/5xx 等暂时性故障的重试次数（默认 3）"
+    )
+    parser.add_argument(
+        "--retry-base-delay", type=float, default=2.0, help="重试退避的基准等待秒数，按 2 的幂递增并随机抖动（默认 2）"
+    )
+    parser.add_argument("--model", help=f"云函数使用的模型（默认由云函数决定，即 {DEFAULT_MODEL}）")
+    parser.add_argument("--ai-cache", default=AI_CACHE_PATH, help=f"AI 结果缓存文件（默认 {AI_CACHE_PATH}）")
+    parser.add_argument("--no-ai-cache", action="store_true", help="不读写 AI 结果缓存")
+    parser.add_argument(
+        "--ai-cache-max-mb", type=float, default=200, help="AI 缓存容量上限（MB），超出按最近使用淘汰"
+    )
+    args = parser.parse_args(argv)
 
     # 创建输出目录
     out_dir = Path(args.output_dir)
@@ -237,145 +722,253 @@ def main() -> None:
         sys.exit(2)
 
     issue_title = args.issue_title or outline_obj.get("issueTitle") or args.issue_id
-    publish_date = args.publish_date or ""
+    publish_date = args.publish_date or outline_obj.get("publishDate") or ""
     pdf_url = f"{args.oss_base_url.rstrip('/')}/data/pdfs/{args.issue_id}.pdf"
 
-    # 读取所有 Markdown 文件（保持原始顺序和分组）
-    md_file_contents = []
-    for md_path in args.md_files:
-        md_file_contents.append({
-            "path": md_path,
-            "content": Path(md_path).read_text(encoding="utf-8")
-        })
-    
-    # 合并所有 MD（用于兜底匹配）
-    combined_md = "\n\n".join(f["content"] for f in md_file_contents)
+    # 第一遍：流式扫描全部 Markdown，只建立标题索引，之后的匹配都是查表
+    heading_index = build_heading_index(args.md_files)
     outline_titles = [art["title"] for art in outline]
 
     # 解析 Markdown
     print(f"[INFO] 解析 Markdown，共 {len(outline)} 篇文章...")
-    sections = parse_markdown_by_outline(combined_md, outline_titles)
-
-    # 构建 issue JSON 和 markdown
-    md_parts = []
-    articles = []
-    # 按 MD 文件分组的 AI 输入（新增）
-    ai_inputs_by_file: List[Dict[str, Any]] = []  # [{"md_path": str, "articles": [...]}]
+    fuzzy_report: List[Dict[str, Any]] = []
+    if args.fuzzy_threshold > 0 and fuzz_process is None:
+        print("[WARN] 未安装 rapidfuzz/numpy，跳过标题模糊匹配。请先执行：python3 -m pip install rapidfuzz numpy")
+    sections = match_outline_sections(heading_index, outline_titles, args.fuzzy_threshold, fuzzy_report)
+    for m in fuzzy_report:
+        print(f"[INFO] 模糊匹配: {m['title']} ← {m['heading']}（得分 {m['score']:.0f}）")
 
-    for idx, art in enumerate(outline):
+    # 确定每篇文章的正文区间（可能多篇共用一个区间）
+    spans: List[Dict[str, Any]] = []
+    span_ids: Dict[Tuple[int, int], int] = {}
+    article_span: List[Optional[int]] = []
+    for art in outline:
         title = art["title"]
-        title_norm = normalize_title(title)
-        page = int(art["pageNumber"])
-
-        # 尝试匹配
-        info = sections.get(title_norm)
-        if not info:
+        span = sections.get(normalize_title(title))
+        if not span:
             print(f"[WARN] 未找到精确匹配: {title}")
-            info = manual_find_section(combined_md, title, outline_titles)
-            if info:
+            span = manual_find_section(heading_index, title, outline_titles)
+            if span:
                 print(f"[INFO] 兜底匹配成功: {title}")
+        if span is None:
+            article_span.append(None)
+            continue
+        sid = span_ids.setdefault((span["start"], span["end"]), len(spans))
+        if sid == len(spans):
+            spans.append(span)
+        article_span.append(sid)
+    span_articles: Dict[int, List[int]] = {}
+    for idx, sid in enumerate(article_span):
+        if sid is not None:
+            span_articles.setdefault(sid, []).append(idx)
 
-        content = info.get("content", "") if info else ""
-        image = info.get("image", "") if info else ""
-        disclaimer = info.get("disclaimer", "") if info else ""
-
-        # 构建 Markdown 片段
-        md = f"## {title}\n"
-        if image:
-            md += f"![]({image})\n\n"
-        md += content + "\n\n---\n\n"
-        md_parts.append(md)
-
-        # 构建文章 JSON
-        article_obj = {
-            "id": f"{args.issue_id}-{idx}",
-            "title": title,
-            "pageNumber": page,
-            "order": idx,
-            "coverImage": image,
-            "summary": "",
-            "insight": "",
-            "disclaimer": disclaimer,
-        }
-        articles.append(article_obj)
-
-        # 如果有内容，找出所属的 MD 文件并加入 AI 处理队列
-        if content:
-            # 查找该文章属于哪个 MD 文件
-            found_in_file = None
-            for md_file in md_file_contents:
-                # 标准化后检查：移除空格和统一竖线符号
-                md_content_norm = md_file["content"].replace(" ", "").replace("｜", "|")
-                title_check = title.replace(" ", "").replace("｜", "|")
-                if title_check in md_content_norm:
-                    found_in_file = md_file["path"]
-                    break
-            
-            # 如果找不到，默认归入第一个文件
-            if not found_in_file:
-                found_in_file = md_file_contents[0]["path"] if md_file_contents else "unknown"
-            
-            # 加入对应文件的 AI 输入组
-            group = next((g for g in ai_inputs_by_file if g["md_path"] == found_in_file), None)
-            if not group:
-                group = {"md_path": found_in_file, "articles": []}
-                ai_inputs_by_file.append(group)
-            
-            group["articles"].append({
-                "id": article_obj["id"],
-                "title": title,
-                "content": content,
-            })
-
-    # 写入 Markdown
-    md_path = md_dir / f"{args.issue_id}.md"
-    md_path.write_text("".join(md_parts), encoding="utf-8")
-    print(f"[INFO] Markdown 已保存: {md_path}")
-
-    # 调用 Gemini（如果提供了端点）
-    if args.gemini_endpoint and ai_inputs_by_file:
-        total_articles = sum(len(g["articles"]) for g in ai_inputs_by_file)
-        print(f"[INFO] 调用 Gemini，共 {total_articles} 篇文章，分 {len(ai_inputs_by_file)} 个 MD 文件处理...")
-        
-        # 读取 prompt
-        prompt_text = None
+    # 需要 AI 处理时先准备 prompt 与缓存：文章写出时即查缓存，只保留未命中文章的正文
+    use_ai = bool(args.gemini_endpoint)
+    prompt_text = None
+    cache_conn = None
+    cache_keys: Dict[str, str] = {}
+    cache_hits = 0
+    if use_ai:
         if args.prompt_file:
             try:
                 prompt_text = Path(args.prompt_file).read_text(encoding="utf-8")
             except Exception as e:
                 print(f"[WARN] 无法读取 prompt 文件: {e}")
+        if not args.no_ai_cache:
+            cache_conn = open_ai_cache(Path(args.ai_cache))
+    model_name = args.model or DEFAULT_MODEL
 
-        # 按 MD 文件分组调用 Gemini
-        for file_idx, group in enumerate(ai_inputs_by_file, start=1):
-            md_file_name = Path(group["md_path"]).name
-            articles_in_file = group["articles"]
-            print(f"\n[INFO] 处理 MD 文件 {file_idx}/{len(ai_inputs_by_file)}: {md_file_name} ({len(articles_in_file)} 篇文章)")
-            
-            try:
-                resp = call_gemini(
+    # 增量模式：按内容指纹复用上次构建的摘要
+    issue_path = issues_dir / f"{args.issue_id}.json"
+    previous = load_previous_articles(issue_path) if args.incremental else {}
+    if args.incremental:
+        print(f"[INFO] 增量构建：已有 {len(previous)} 篇带摘要的文章")
+    reused = 0
+
+    articles = []
+    # 检索索引：正文只在流式写出时可见，先统计正文词项，摘要生成后再补上标题/摘要/洞察
+    body_terms: List[Dict[str, int]] = []
+    # 按 MD 文件分组的 AI 输入
+    ai_inputs_by_file: List[Dict[str, Any]] = []  # [{"md_path": str, "articles": [...]}]
+
+    # 第二遍：流式读取正文，按 outline 顺序逐篇写出 Markdown；
+    # 正文顺序与 outline 不一致时，先读到的文章暂存到轮到它为止
+    md_path = md_dir / f"{args.issue_id}.md"
+    md_tmp = md_path.with_name(md_path.name + ".tmp")
+    ready: Dict[int, Dict[str, Optional[str]]] = {}
+    next_idx = 0
+
+    with open(md_tmp, "w", encoding="utf-8") as md_out:
+        def flush_ready() -> None:
+            nonlocal next_idx, cache_hits, reused
+            while next_idx < len(outline) and (article_span[next_idx] is None or next_idx in ready):
+                idx = next_idx
+                next_idx += 1
+                art = outline[idx]
+                title = art["title"]
+                info = ready.pop(idx, None)
+                content = info.get("content", "") if info else ""
+                image = info.get("image", "") if info else ""
+                disclaimer = info.get("disclaimer", "") if info else ""
+
+                # 写出 Markdown 片段
+                md = f"## {title}\n"
+                if image:
+                    md += f"![]({image})\n\n"
+                md += content + "\n\n---\n\n"
+                md_out.write(md)
+
+                # 构建文章 JSON
+                article_obj = {
+                    "id": f"{args.issue_id}-{idx}",
+                    "title": title,
+                    "pageNumber": int(art["pageNumber"]),
+                    "order": idx,
+                    "coverImage": image,
+                    "summary": "",
+                    "insight": "",
+                    "disclaimer": disclaimer,
+                    "contentHash": article_content_hash(title, content),
+                }
+                articles.append(article_obj)
+                if not args.no_search_index:
+                    body_terms.append(article_terms({"body": content}))
+
+                # 内容未变的文章沿用上次的摘要
+                prev = previous.get(article_obj["contentHash"])
+                if prev and content:
+                    article_obj["summary"] = prev.get("summary", "")
+                    article_obj["insight"] = prev.get("insight", "")
+                    reused += 1
+                    continue
+
+                # 如果有内容，查缓存；未命中的按所属 MD 文件加入 AI 处理队列
+                if not (content and use_ai):
+                    continue
+                if cache_conn is not None:
+                    key = ai_cache_key(title, content, prompt_text, model_name)
+                    cached = ai_cache_get(cache_conn, key)
+                    if cached:
+                        article_obj.update(cached)
+                        cache_hits += 1
+                        continue
+                    cache_keys[article_obj["id"]] = key
+
+                found_in_file = spans[article_span[idx]]["file"]
+                group = next((g for g in ai_inputs_by_file if g["md_path"] == found_in_file), None)
+                if not group:
+                    group = {"md_path": found_in_file, "articles": []}
+                    ai_inputs_by_file.append(group)
+                group["articles"].append({
+                    "id": article_obj["id"],
+                    "title": title,
+                    "content": content,
+                })
+
+        flush_ready()
+        for sid, body in iter_section_bodies(args.md_files, spans):
+            info = _section_from_body(body)
+            for idx in span_articles[sid]:
+                ready[idx] = info
+            flush_ready()
+        flush_ready()
+    os.replace(md_tmp, md_path)
+    print(f"[INFO] Markdown 已保存: {md_path}")
+    if args.incremental:
+        print(f"[INFO] 增量构建：{reused} 篇未变沿用摘要，{len(articles) - reused} 篇新增或改动")
+
+    # 调用 Gemini（如果提供了端点）
+    if use_ai:
+        articles_by_id = {a["id"]: a for a in articles}
+
+        # 按 token 预算重新分批（不再按 MD 文件分组），最长文章所在批次先发
+        source_of = {a["id"]: Path(g["md_path"]).name for g in ai_inputs_by_file for a in g["articles"]}
+        batches = pack_ai_batches(
+            [a for g in ai_inputs_by_file for a in g["articles"]],
+            args.batch_input_tokens,
+            args.batch_output_tokens,
+            args.output_tokens_per_article,
+        )
+        total_articles = len(source_of)
+        if total_articles:
+            print(
+                f"[INFO] 调用 Gemini，共 {total_articles} 篇文章，分 {len(batches)} 批"
+                f"（预算：输入 {args.batch_input_tokens} / 输出 {args.batch_output_tokens} tokens）"
+            )
+            for batch_idx, batch in enumerate(batches, start=1):
+                sources = sorted({source_of[a["id"]] for a in batch["articles"]})
+                print(
+                    f"  - 批次 {batch_idx}: {len(batch['articles'])} 篇，输入约 {batch['inputTokens']} tokens，"
+                    f"输出约 {batch['outputTokens']} tokens，来自 {', '.join(sources)}"
+                )
+        else:
+            print("[INFO] 没有需要生成摘要的文章（均已沿用或命中缓存），无需调用 Gemini")
+
+        # 各批并发调用 Gemini，哪批先返回先回填
+        concurrency = max(1, args.concurrency)
+        t_ai = time.perf_counter()
+        latencies: List[float] = []
+        failed_total = 0
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(batches)))) as pool:
+            futures = {}
+            for batch_idx, batch in enumerate(batches, start=1):
+                fut = pool.submit(
+                    summarize_batch,
                     args.gemini_endpoint,
                     args.issue_id,
-                    articles_in_file,
+                    batch["articles"],
                     args.gemini_api_key,
                     prompt_text,
+                    args.model,
+                    args.retries,
+                    args.retry_base_delay,
                 )
-                
-                if "articles" not in resp:
-                    print(f"[WARN] Gemini 返回格式异常，缺少 articles 字段")
-                    print(f"[DEBUG] 响应: {json.dumps(resp, ensure_ascii=False)[:500]}")
-                    continue
-                
+                futures[fut] = f"批次 {batch_idx}/{len(batches)}"
+
+            for fut in as_completed(futures):
+                label = futures[fut]
+                outcome = fut.result()
+                by_id = outcome["articles"]
+                elapsed = outcome["seconds"]
+                latencies.append(elapsed)
                 # 回填 summary 和 insight
-                by_id = {a["id"]: a for a in resp.get("articles", [])}
-                for art in articles:
-                    obj = by_id.get(art["id"])
-                    if obj:
+                for art_id, obj in by_id.items():
+                    art = articles_by_id.get(art_id)
+                    if art:
                         art["summary"] = obj.get("summary", "")
                         art["insight"] = obj.get("insight", "")
-                
-                print(f"[INFO] ✅ {md_file_name}: 成功处理 {len(by_id)} 篇文章")
-            except Exception as e:
-                print(f"[WARN] ❌ {md_file_name}: 处理失败 - {e}")
+                        if cache_conn is not None and art_id in cache_keys and art["summary"]:
+                            ai_cache_put(cache_conn, cache_keys[art_id], art["summary"], art["insight"])
+                extra = f"，拆分为 {outcome['requests']} 次请求" if outcome["requests"] > 1 else ""
+                if outcome["failed"]:
+                    print(
+                        f"[WARN] ⚠️ {label}: 成功 {len(by_id)} 篇，失败 {len(outcome['failed'])} 篇{extra}，"
+                        f"耗时 {elapsed:.1f}s"
+                    )
+                    for art_id, err in outcome["failed"].items():
+                        print(f"  - {art_id} {articles_by_id[art_id]['title']}: {err[:200]}")
+                    failed_total += len(outcome["failed"])
+                else:
+                    print(f"[INFO] ✅ {label}: 成功处理 {len(by_id)} 篇文章{extra}，耗时 {elapsed:.1f}s")
+
+        wall = time.perf_counter() - t_ai
+        if latencies:
+            print(
+                f"[INFO] Gemini 总耗时 {wall:.1f}s（并发 {concurrency}；单批最长 {max(latencies):.1f}s，"
+                f"各批累计 {sum(latencies):.1f}s）"
+            )
+        if failed_total:
+            print(f"[WARN] 共 {failed_total} 篇文章未能生成摘要，可稍后重跑（已完成的文章会命中缓存）")
+
+        if cache_conn is not None:
+            evicted = ai_cache_evict(cache_conn, int(args.ai_cache_max_mb * 1024 * 1024))
+            cache_conn.close()
+            looked_up = cache_hits + len(cache_keys)
+            rate = cache_hits / looked_up * 100 if looked_up else 0
+            print(
+                f"[INFO] AI 缓存：命中 {cache_hits} 篇，未命中 {len(cache_keys)} 篇（命中率 {rate:.0f}%）"
+                + (f"，淘汰 {evicted} 条" if evicted else "")
+            )
 
     # 写入 issue JSON
     issue_json = {
@@ -385,12 +978,27 @@ def main() -> None:
         "pdfUrl": pdf_url,
         "articles": articles,
     }
-    issue_path = issues_dir / f"{args.issue_id}.json"
-    issue_path.write_text(
-        json.dumps(issue_json, ensure_ascii=False, indent=2), encoding="utf-8"
-    )
+    write_text_atomic(issue_path, json.dumps(issue_json, ensure_ascii=False, indent=2))
     print(f"[INFO] Issue JSON 已保存: {issue_path}")
 
+    # 合并进全文检索索引
+    if not args.no_search_index:
+        doc_terms = []
+        for art, terms in zip(articles, body_terms):
+            merged = Counter(terms)
+            merged.update(article_terms({"title": art["title"], "summary": art["summary"], "insight": art["insight"]}))
+            doc_terms.append(dict(merged))
+        titles = [a["title"] for a in articles]
+        if args.defer_search_index:
+            stage_issue_index(data_dir / SEARCH_DIR, args.issue_id, titles, doc_terms, args.search_shards)
+            print("[INFO] 检索词项已暂存，待批量构建结束后统一合并")
+        else:
+            stats = merge_issue_index(data_dir / SEARCH_DIR, args.issue_id, titles, doc_terms, args.search_shards)
+            print(
+                f"[INFO] 检索索引已更新: {stats['terms']} 个词项、{stats['postings']} 条倒排，"
+                f"改写 {stats['shards']} 个分片（{stats['bytes'] / 1024:.0f} KB）"
+            )
+
     # 打印上传清单
     print(
         textwrap.dedent(
@@ -408,6 +1016,7 @@ def main() -> None:
         """
         )
     )
+    return issue_path
 
 
 if __name__ == "__main__":
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+云函数并发压测：对比同步 handler 与异步 async_handler 在单个实例内能同时承载多少请求
+
+会在子进程中启动一个本地模拟上游（chat/completions，固定延迟返回批量 JSON），
+把 caixin_index.py 的上游地址指向它（并关闭响应缓存，避免相同请求被合并），然后：
+  - sync ：用 --concurrency 个线程模拟实例并发，逐个调用 handler
+  - async：在同一个事件循环上同时发起至多 --concurrency 个 async_handler
+输出每种模式的吞吐（请求/秒）、延迟分位数、实例进程内的峰值线程数，以及模拟上游观察到的峰值在途请求数。
+
+用法示例：
+  python3 tools/load_test_fc.py --requests 400 --concurrency 100 --latency 1.0
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def serve_mock(port: int, latency: float) -> None:
+    """模拟上游：每个请求等待 latency 秒后返回各篇文章的摘要 JSON；GET 返回请求数与峰值在途数"""
+    stats = {"requests": 0, "in_flight": 0, "peak": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, data: bytes) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            with lock:
+                if self.path == "/reset":
+                    stats["peak"] = stats["in_flight"]
+                self._send(json.dumps(stats).encode())
+
+        def do_POST(self) -> None:
+            with lock:
+                stats["requests"] += 1
+                stats["in_flight"] += 1
+                stats["peak"] = max(stats["peak"], stats["in_flight"])
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                user = json.loads(body["messages"][-1]["content"])
+                content = json.dumps({
+                    "issueId": user.get("issueId"),
+                    "articles": [
+                        {"id": a["id"], "summary": f"摘要：{a['title']}", "insight": f"洞察：{a['title']}"}
+                        for a in user.get("articles", [])
+                    ],
+                }, ensure_ascii=False)
+                time.sleep(latency)
+                self._send(json.dumps({"choices": [{"message": {"content": content}}]}, ensure_ascii=False).encode())
+            finally:
+                with lock:
+                    stats["in_flight"] -= 1
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 1024  # 异步模式会瞬间发起大量连接，默认 backlog 5 会导致连接被重置
+
+    Server(("127.0.0.1", port), Handler).serve_forever()
+
+
+def mock_stats(port: int, reset: bool = False) -> Dict[str, int]:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/{'reset' if reset else ''}") as resp:
+        return json.load(resp)
+
+
+def make_event(i: int, articles: int) -> bytes:
+    body = {
+        "issueId": f"load-{i}",
+        "articles": [{"id": f"{i}-{j}", "title": f"第 {i} 个请求的第 {j} 篇", "content": "正文" * 200}
+                     for j in range(articles)],
+    }
+    return json.dumps({
+        "headers": {"origin": "http://localhost:5173"},
+        "requestContext": {"http": {"method": "POST"}},
+        "body": json.dumps(body, ensure_ascii=False),
+    }).encode("utf-8")
+
+
+class ThreadSampler:
+    """后台采样本进程的线程数，记录峰值"""
+
+    def __init__(self) -> None:
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(0.01):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self) -> "ThreadSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def run_sync(index: Any, events: List[bytes], concurrency: int) -> List[Dict[str, Any]]:
+    def one(event: bytes) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        resp = index.handler(event, None)
+        return {"status": resp["statusCode"], "seconds": time.perf_counter() - t0}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, events))
+
+
+def run_async(index: Any, events: List[bytes], concurrency: int) -> List[Dict[str, Any]]:
+    async def main() -> List[Dict[str, Any]]:
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one(event: bytes) -> Dict[str, Any]:
+            async with limit:
+                t0 = time.perf_counter()
+                resp = await index.async_handler(event, None)
+                return {"status": resp["statusCode"], "seconds": time.perf_counter() - t0}
+
+        return await asyncio.gather(*(one(e) for e in events))
+
+    return asyncio.run(main())
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="对本地模拟上游压测云函数的同步与异步入口")
+    parser.add_argument("--requests", type=int, default=200, help="每种模式发出的请求数（默认 200）")
+    parser.add_argument("--concurrency", type=int, default=50, help="实例内同时处理的请求数（默认 50）")
+    parser.add_argument("--latency", type=float, default=1.0, help="模拟上游每次调用的耗时秒数（默认 1.0）")
+    parser.add_argument("--articles", type=int, default=3, help="每个请求的文章数，不超过单块上限时不拆分（默认 3）")
+    parser.add_argument("--modes", default="sync,async", help="压测的入口，逗号分隔：sync,async")
+    parser.add_argument("--port", type=int, default=18765, help="模拟上游端口（默认 18765）")
+    parser.add_argument("--summary-json", default="", help="同时把结果写入该 JSON 文件")
+    parser.add_argument("--serve-mock", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_mock:
+        serve_mock(args.port, args.latency)
+        return
+
+    mock = subprocess.Popen([
+        sys.executable, __file__, "--serve-mock", "--port", str(args.port), "--latency", str(args.latency),
+    ])
+    try:
+        for _ in range(50):
+            try:
+                mock_stats(args.port)
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            raise SystemExit("模拟上游未能启动")
+
+        # 必须在导入云函数模块之前设置：上游地址、连接池大小与缓存开关在导入时读取
+        os.environ["UPSTREAM_API_URL"] = f"http://127.0.0.1:{args.port}/v1/chat/completions"
+        os.environ.setdefault("THIRTY_TWO_AI_API_KEY", "load-test")
+        os.environ["RESPONSE_CACHE"] = "off"
+        # 大批量请求会拆成至多 FANOUT_CONCURRENCY 路并发调用上游，连接上限按此放大，否则异步入口会被连接数卡住
+        upstream_connections = args.concurrency * int(os.environ.get("FANOUT_CONCURRENCY", "4"))
+        os.environ.setdefault("UPSTREAM_POOL_SIZE", str(upstream_connections))
+        os.environ.setdefault("UPSTREAM_ASYNC_MAX_CONNECTIONS", str(upstream_connections))
+        sys.path.insert(0, str(REPO_ROOT))
+        import caixin_index as index
+        logging.getLogger("urllib3").setLevel(logging.ERROR)
+
+        if index.httpx is None:
+            print("[WARN] 未安装 httpx，异步入口将退回线程池调用，结果不代表异步客户端的表现")
+
+        summary: Dict[str, Any] = {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "latency": args.latency,
+            "modes": [],
+        }
+        runners = {"sync": run_sync, "async": run_async}
+        for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+            events = [make_event(i, args.articles) for i in range(args.requests)]
+            before = mock_stats(args.port, reset=True)
+            base_threads = threading.active_count()
+            t0 = time.perf_counter()
+            # 云函数每个请求都会打印调试日志，压测期间丢弃
+            with ThreadSampler() as sampler, contextlib.redirect_stdout(io.StringIO()):
+                results = runners[mode](index, events, args.concurrency)
+            elapsed = time.perf_counter() - t0
+            after = mock_stats(args.port)
+
+            latencies = [r["seconds"] for r in results]
+            ok = sum(1 for r in results if r["status"] == 200)
+            row = {
+                "mode": mode,
+                "ok": ok,
+                "failed": len(results) - ok,
+                "seconds": round(elapsed, 2),
+                "requestsPerSecond": round(len(results) / elapsed, 2),
+                "p50": round(percentile(latencies, 50), 3),
+                "p95": round(percentile(latencies, 95), 3),
+                "peakThreads": sampler.peak - base_threads,
+                "upstreamCalls": after["requests"] - before["requests"],
+                "upstreamPeakInFlight": after["peak"],
+            }
+            summary["modes"].append(row)
+            print(
+                f"{mode:5s} 并发 {args.concurrency}：{ok}/{len(results)} 成功，{row['seconds']}s，"
+                f"{row['requestsPerSecond']} 请求/秒，p50 {row['p50']}s，p95 {row['p95']}s，"
+                f"新增线程峰值 {row['peakThreads']}，上游峰值在途 {row['upstreamPeakInFlight']}"
+            )
+        ideal = args.concurrency / args.latency if args.latency > 0 else 0
+        print(f"理论上限（并发 / 上游延迟）：{ideal:.1f} 请求/秒")
+        if args.summary_json:
+            with open(args.summary_json, "w", encoding="utf-8") as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+批量渲染多期 PDF：所有期次共享同一个进程池。
+
+输入目录约定：
+  {input-dir}/{issueId}.pdf
+  {input-dir}/{issueId}-outline.json   （可选，与单期脚本的 --outline 相同）
+
+输出：{out-root}/{issueId}/ 下的图片与 manifest.json，与 render_pdf_pages.py 单期产物一致。
+
+调度方式：先为每期做渲染准备（查缓存、估算每页开销），再把每期的待渲染页按开销
+均衡地分成若干组（每组只含同一期的页，子进程打开一次 PDF 即可渲染整组），所有期次
+的组合并后按总开销从大到小提交到同一个进程池（最长任务优先），避免逐期渲染时
+"一期收尾、其他进程空等" 的空档；某期最后一组完成即落盘缓存并写出 manifest。
+
+用法示例：
+  python3 tools/render_pdf_batch.py --input-dir ./issues --workers 0 --tiers 240,640
+"""
+
+import argparse
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from render_pdf_pages import (
+    _render_page_range,
+    add_render_arguments,
+    finish_render,
+    load_outline,
+    peak_rss_mb,
+    prepare_render,
+    print_render_report,
+    record_page_result,
+    render_options_from_args,
+    resolve_workers,
+    write_manifest,
+)
+
+
+def find_issues(input_dir: Path) -> List[Tuple[str, Path, Path]]:
+    """返回 [(issueId, pdf 路径, outline 路径), ...]，按 issueId 排序。"""
+    issues = []
+    for pdf_path in sorted(input_dir.glob("*.pdf")):
+        issue_id = pdf_path.stem
+        issues.append((issue_id, pdf_path, input_dir / f"{issue_id}-outline.json"))
+    return issues
+
+
+def schedule_pages(plans: Dict[str, Dict[str, Any]], workers: int) -> List[Tuple[int, str, List[int]]]:
+    """把各期待渲染页分组为 [(组开销, issueId, 页码列表), ...]，开销大的在前。
+
+    每组只含同一期的页：逐页穿插时每个子进程都要轮流打开多份 PDF，超过 _WORKER_PDF_LIMIT
+    份就会反复关闭、重开。总组数约为进程数的 4 倍，期内按开销从大到小把页分给当前最轻的组，
+    各组开销大致相当。
+    """
+    total = sum(len(plan["todo"]) for plan in plans.values())
+    group_size = max(1, total // max(1, workers * 4))
+    tasks = []
+    for issue_id, plan in plans.items():
+        costs = plan["costs"]
+        pages = sorted(plan["todo"], key=lambda n: (-costs.get(n, 0), n))
+        if not pages:
+            continue
+        groups: List[Tuple[int, List[int]]] = [(0, []) for _ in range(-(-len(pages) // group_size))]
+        for page_num in pages:
+            i = min(range(len(groups)), key=lambda k: groups[k][0])
+            groups[i] = (groups[i][0] + costs.get(page_num, 0), groups[i][1] + [page_num])
+        tasks.extend((cost, issue_id, sorted(nums)) for cost, nums in groups)
+    tasks.sort(key=lambda t: (-t[0], t[1], t[2][0]))
+    return tasks
+
+
+def _render_group(
+    pdf_path: str, out_dir: str, page_nums: List[int], settings: Dict[str, Any]
+) -> Tuple[float, List[Tuple[int, Dict[str, Any]]]]:
+    """子进程入口：渲染一组页，另返回开始时刻（time.time()，跨进程可比），用于统计每期耗时。"""
+    started = time.time()
+    return started, _render_page_range(pdf_path, out_dir, page_nums, settings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Render a directory of issue PDFs with one shared worker pool.")
+    parser.add_argument("--input-dir", required=True, help="Directory with {issue}.pdf and optional {issue}-outline.json.")
+    parser.add_argument("--out-root", default="public/data/pages", help="Output root; each issue goes to <out-root>/<issue>/.")
+    parser.add_argument("--issues", default="", help="Only render these issue ids, comma separated.")
+    parser.add_argument("--summary-json", default="", help="Also write the throughput summary to this JSON file.")
+    add_render_arguments(parser)
+    args = parser.parse_args()
+
+    input_dir = Path(args.input_dir)
+    out_root = Path(args.out_root)
+    wanted = {s.strip() for s in args.issues.split(",") if s.strip()}
+    issues = [i for i in find_issues(input_dir) if not wanted or i[0] in wanted]
+    if not issues:
+        raise SystemExit(f"未在 {input_dir} 下找到 PDF")
+    workers = resolve_workers(args.workers)
+
+    t0 = time.perf_counter()
+    plans: Dict[str, Dict[str, Any]] = {}
+    outlines: Dict[str, Dict[str, Any]] = {}
+    for issue_id, pdf_path, outline_path in issues:
+        out_dir = out_root / issue_id
+        out_dir.mkdir(parents=True, exist_ok=True)
+        print(f"[INFO] 准备 {issue_id}")
+        plans[issue_id] = prepare_render(pdf_path, out_dir, with_costs=True, **render_options_from_args(args, out_dir))
+        outlines[issue_id] = load_outline(outline_path)
+
+    stats: Dict[str, Dict[str, Any]] = {
+        issue_id: {"pages": len(plan["todo"]), "start": None, "seconds": 0.0}
+        # start 为该期第一组实际开始渲染的时刻，不是提交时刻；全部命中缓存的期次为 None
+        for issue_id, plan in plans.items()
+    }
+    remaining = {issue_id: len(plan["todo"]) for issue_id, plan in plans.items()}
+    results: Dict[str, Dict[str, Any]] = {}
+
+    def finish_issue(issue_id: str) -> None:
+        plan = plans[issue_id]
+        info = finish_render(plan)
+        write_manifest(plan["out_dir"], info, outlines[issue_id])
+        results[issue_id] = info
+        st = stats[issue_id]
+        if st["start"] is not None:
+            st["seconds"] = time.time() - st["start"]
+        print(f"[INFO] {issue_id} 完成：{info['numPages']} 页，本次渲染 {st['pages']} 页")
+
+    # 全部命中缓存的期次直接收尾
+    for issue_id in plans:
+        if remaining[issue_id] == 0:
+            finish_issue(issue_id)
+
+    tasks = schedule_pages(plans, workers)
+    t_render = time.perf_counter()
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for _, issue_id, page_nums in tasks:
+                plan = plans[issue_id]
+                fut = pool.submit(
+                    _render_group,
+                    plan["pdf_path"].as_posix(),
+                    plan["out_dir"].as_posix(),
+                    page_nums,
+                    plan["settings"],
+                )
+                futures[fut] = issue_id
+            for fut in as_completed(futures):
+                issue_id = futures[fut]
+                started, page_results = fut.result()
+                st = stats[issue_id]
+                st["start"] = started if st["start"] is None else min(st["start"], started)
+                for page_num, record in page_results:
+                    record_page_result(plans[issue_id], page_num, record)
+                remaining[issue_id] -= len(page_results)
+                if remaining[issue_id] == 0:
+                    finish_issue(issue_id)
+    elapsed = time.perf_counter() - t0
+    render_elapsed = time.perf_counter() - t_render
+
+    total_pages = sum(st["pages"] for st in stats.values())
+    print(f"完成：共 {len(issues)} 期，本次渲染 {total_pages} 页，{workers} 进程，耗时 {elapsed:.1f}s")
+    summary: Dict[str, Any] = {
+        "workers": workers,
+        "seconds": round(elapsed, 2),
+        "renderSeconds": round(render_elapsed, 2),
+        "pages": total_pages,
+        "pagesPerSecond": round(total_pages / render_elapsed, 2) if render_elapsed > 0 and total_pages else 0,
+        "issues": [],
+    }
+    for issue_id, _, _ in issues:
+        st = stats[issue_id]
+        rate = st["pages"] / st["seconds"] if st["seconds"] > 0 and st["pages"] else 0
+        print(f"  - {issue_id}：{st['pages']} 页，{st['seconds']:.1f}s（{rate:.1f} 页/秒）")
+        print_render_report(plans[issue_id]["out_dir"], results[issue_id])
+        summary["issues"].append({
+            "id": issue_id,
+            "pages": st["pages"],
+            "seconds": round(st["seconds"], 2),
+            "pagesPerSecond": round(rate, 2),
+        })
+    print(f"总吞吐：{summary['pagesPerSecond']} 页/秒")
+    own_rss, child_rss = peak_rss_mb()
+    if own_rss and tasks:
+        print(f"峰值内存：主进程 {own_rss:.0f} MB，单个渲染进程最高 {child_rss:.0f} MB")
+    elif own_rss:
+        print(f"峰值内存：主进程 {own_rss:.0f} MB")
+    if args.summary_json:
+        with open(args.summary_json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,15 +11,24 @@
     --out "public/data/pages/2025-40" \
     --width 1024 \
     --quality 75 \
-    --format webp
+    --format webp \
+    --workers 4
 """
 from __future__ import annotations
 
 import argparse
+import array
+import hashlib
+import io
 import json
+import math
 import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 try:
     import fitz  # PyMuPDF  # pyright: ignore[reportMissingImports]
@@ -29,16 +38,892 @@ except Exception as exc:
         f"导入错误：{exc}"
     )
 try:
-    from PIL import Image  # Pillow（用于导出 JPEG / WEBP）
+    import resource  # 仅 Unix，用于统计峰值内存
+except ImportError:
+    resource = None
+try:
+    from PIL import Image, ImageStat  # Pillow（用于导出 JPEG / WEBP）
 except Exception:
     Image = None  # 允许缺失，届时退回 PNG
+    ImageStat = None
 
 
 def ensure_dir(path: Path) -> None:
     path.mkdir(parents=True, exist_ok=True)
 
 
-def render_pdf_to_images(
+def _page_out_name(page_num: int, img_format: str) -> str:
+    out_ext = ('jpg' if img_format in ('jpeg', 'jpg') else img_format)
+    return f"{page_num:03d}.{out_ext}"
+
+
+def _tier_dir(width: int) -> str:
+    return f"w{width}"
+
+
+TILE_SIZE = 256
+TILES_DIR = "tiles"
+
+
+def write_tile_pyramid(
+    img: "Image.Image",
+    page_num: int,
+    out_dir: Path,
+    img_format: str,
+    quality: int,
+    tile_size: int = TILE_SIZE,
+) -> Dict[str, Any]:
+    """按 Deep Zoom (DZI) 约定为单页写出瓦片金字塔。
+
+    目录结构：tiles/{页码}_files/{level}/{col}_{row}.{ext}，外加 tiles/{页码}.dzi。
+    最高层为原图尺寸，每降一层宽高减半（向上取整），直到 1x1；瓦片无重叠。
+    .dzi 最后写出，用作整页瓦片完整性的标记。
+    """
+    ext = _page_out_name(page_num, img_format).rsplit(".", 1)[1]
+    stem = f"{page_num:03d}"
+    files_dir = out_dir / TILES_DIR / f"{stem}_files"
+    full_w, full_h = img.size
+    max_level = math.ceil(math.log2(max(full_w, full_h))) if max(full_w, full_h) > 1 else 0
+    level_img = img
+    count = 0
+    for level in range(max_level, -1, -1):
+        lw, lh = level_img.size
+        level_dir = files_dir / str(level)
+        ensure_dir(level_dir)
+        for col in range(math.ceil(lw / tile_size)):
+            for row in range(math.ceil(lh / tile_size)):
+                box = (
+                    col * tile_size,
+                    row * tile_size,
+                    min(lw, (col + 1) * tile_size),
+                    min(lh, (row + 1) * tile_size),
+                )
+                _save_pil(level_img.crop(box), level_dir / f"{col}_{row}.{ext}", img_format, quality)
+                count += 1
+        if level > 0:
+            level_img = level_img.resize(
+                (max(1, math.ceil(lw / 2)), max(1, math.ceil(lh / 2))), Image.LANCZOS
+            )
+    dzi_name = f"{TILES_DIR}/{stem}.dzi"
+    with open(out_dir / dzi_name, "w", encoding="utf-8") as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{tile_size}" '
+            f'Overlap="0" Format="{ext}"><Size Width="{full_w}" Height="{full_h}"/></Image>\n'
+        )
+    return {"dzi": dzi_name, "width": full_w, "height": full_h, "maxLevel": max_level, "tileCount": count}
+
+
+def _save_pil(img: "Image.Image", dest: Any, img_format: str, quality: int) -> None:
+    save_format = {"webp": "WEBP", "png": "PNG"}.get(img_format, "JPEG")
+    if isinstance(dest, Path):
+        dest = dest.as_posix()
+    img.save(dest, format=save_format, quality=quality, optimize=True)
+
+
+# ========== 自适应编码 ==========
+
+# 灰度标准差低于该值视为空白页
+BLANK_STDDEV = 2.0
+# 底色（灰度直方图峰值 ±8）像素占比不低于该值视为文字页
+TEXT_BACKGROUND_RATIO = 0.6
+# 文字页调色板颜色数
+TEXT_PALETTE_COLORS = 64
+# 字节预算二分搜索的最低质量
+MIN_BUDGET_QUALITY = 20
+
+
+def classify_page(img: "Image.Image") -> str:
+    """按灰度直方图粗分页面类型：blank / text / photo。
+
+    不先缩略：缩小会把细小文字糊成中间调，文字页容易被误判为照片。
+    """
+    gray = img.convert("L")
+    if ImageStat.Stat(gray).stddev[0] < BLANK_STDDEV:
+        return "blank"
+    hist = gray.histogram()
+    peak = max(range(256), key=hist.__getitem__)
+    background = sum(hist[max(0, peak - 8):peak + 9]) / float(sum(hist))
+    return "text" if background >= TEXT_BACKGROUND_RATIO else "photo"
+
+
+def encode_image(img: "Image.Image", img_format: str, params: Dict[str, Any]) -> bytes:
+    """按编码参数把图片编码为字节串。
+
+    params["encoder"]：lossy（按 format 的有损编码）/ lossless（WebP 无损）/ palette（调色板）。
+    """
+    buf = io.BytesIO()
+    encoder = params["encoder"]
+    if encoder == "lossy" or img_format in ("jpeg", "jpg"):
+        _save_pil(img, buf, img_format, params["quality"])
+    else:
+        if encoder == "palette":
+            img = img.quantize(colors=params["colors"], method=Image.Quantize.MEDIANCUT)
+        if img_format == "webp":
+            # 无损模式下 quality/method 只影响压缩耗时；100/6 单页要十几秒，取默认档
+            img.save(buf, format="WEBP", lossless=True, quality=50, method=4)
+        else:
+            img.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+def choose_encoding(
+    img: "Image.Image",
+    page_class: str,
+    img_format: str,
+    quality: int,
+    budget: int = 0,
+    baseline: Optional[bytes] = None,
+) -> Tuple[Dict[str, Any], bytes]:
+    """为单页挑选编码参数，返回 (参数, 编码结果)。
+
+    文字页优先试调色板/无损编码，比统一有损更小时采用；照片页用有损编码，
+    budget > 0 时在 [MIN_BUDGET_QUALITY, quality] 内二分查找满足字节预算的最高质量。
+    baseline 为调用方已按 quality 有损编码的结果，传入时不再重复编码。
+    """
+    lossy = {"encoder": "lossy", "quality": quality}
+    best = (lossy, baseline if baseline is not None else encode_image(img, img_format, lossy))
+    if page_class == "text" and img_format not in ("jpeg", "jpg"):
+        palette = {"encoder": "palette", "colors": TEXT_PALETTE_COLORS}
+        data = encode_image(img, img_format, palette)
+        if len(data) < len(best[1]):
+            best = (palette, data)
+    if budget > 0 and len(best[1]) > budget and img_format != "png":
+        lo, hi = MIN_BUDGET_QUALITY, quality - 1
+        found = None
+        while lo <= hi:
+            q = (lo + hi) // 2
+            params = {"encoder": "lossy", "quality": q}
+            data = encode_image(img, img_format, params)
+            if len(data) <= budget:
+                found = (params, data)
+                lo = q + 1
+            else:
+                hi = q - 1
+        if found is None:
+            params = {"encoder": "lossy", "quality": MIN_BUDGET_QUALITY}
+            found = (params, encode_image(img, img_format, params))
+        best = found
+    return best
+
+
+def write_blank_placeholder(out_dir: Path, img: "Image.Image", img_format: str) -> str:
+    """空白页共用占位图：同尺寸同底色只写一份。"""
+    color = ImageStat.Stat(img.convert("RGB")).mean
+    color = tuple(min(255, int(round(c / 8.0)) * 8) for c in color)
+    ext = _page_out_name(0, img_format).rsplit(".", 1)[1]
+    name = "blank-{}x{}-{:02x}{:02x}{:02x}.{}".format(img.width, img.height, *color, ext)
+    path = out_dir / name
+    if not path.exists():
+        placeholder = Image.new("RGB", img.size, color)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        _save_pil(placeholder, tmp, img_format, 100)
+        os.replace(tmp, path)
+    return name
+
+
+# ========== 文字层 ==========
+
+TEXT_DIR = ".text"
+TEXT_LAYER_NAME = "text-layer.bin"
+TEXT_LAYER_MAGIC = b"CXTL"
+TEXT_LAYER_VERSION = 1
+
+
+def _u16_le(values: List[int]) -> bytes:
+    arr = array.array("H", values)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _u32_le(values: List[int]) -> bytes:
+    arr = array.array("I", values)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def encode_page_words(page: "fitz.Page", width: int) -> Tuple[bytes, int]:
+    """提取单页词框并按列存储，返回 (页块字节, 词数)。
+
+    坐标换算为 width 档像素（其他档按宽度比例缩放即可），页块布局（小端）：
+      u32 n | u16 x0[n] | u16 y0[n] | u16 x1[n] | u16 y1[n] | u16 line[n] | u16 len[n] | utf-8 文本
+    line 为页内行序号，len 为每个词的 utf-8 字节长度。
+    """
+    scale = float(width) / float(page.rect.width)
+    rot = page.rotation_matrix
+    cols: List[List[int]] = [[], [], [], [], [], []]
+    texts: List[bytes] = []
+    line_ids: Dict[Tuple[int, int], int] = {}
+    for x0, y0, x1, y1, word, block_no, line_no, _ in page.get_text("words"):
+        box = fitz.Rect(x0, y0, x1, y1) * rot
+        raw = word.encode("utf-8")
+        line = line_ids.setdefault((block_no, line_no), len(line_ids))
+        for col, v in zip(
+            cols,
+            (box.x0 * scale, box.y0 * scale, box.x1 * scale, box.y1 * scale, line, len(raw)),
+        ):
+            col.append(min(0xFFFF, max(0, int(round(v)))))
+        texts.append(raw[:0xFFFF])
+    n = len(texts)
+    chunk = _u32_le([n]) + b"".join(_u16_le(col) for col in cols) + b"".join(texts)
+    return chunk, n
+
+
+def write_page_words(page: "fitz.Page", page_num: int, out_dir: Path, width: int) -> Dict[str, Any]:
+    """页块写到 .text/NNN.bin（供缓存复用），最终由 write_text_layer 合并。"""
+    chunk, count = encode_page_words(page, width)
+    name = f"{TEXT_DIR}/{page_num:03d}.bin"
+    with open(out_dir / name, "wb") as f:
+        f.write(chunk)
+    return {"file": name, "words": count}
+
+
+def write_text_layer(out_dir: Path, page_texts: List[Dict[str, Any]], width: int) -> Dict[str, Any]:
+    """把各页页块按 images 顺序合并为整期文字层文件。
+
+    文件布局（小端）：
+      "CXTL" | u8 版本 | u8 保留 | u16 页数 | u32 坐标基准宽度 |
+      u32 offsets[页数 + 1]（各页块相对数据区起点的字节偏移）| 页块...
+    """
+    chunks = []
+    for text in page_texts:
+        with open(out_dir / text["file"], "rb") as f:
+            chunks.append(f.read())
+    offsets = [0]
+    for chunk in chunks:
+        offsets.append(offsets[-1] + len(chunk))
+    header = TEXT_LAYER_MAGIC + bytes([TEXT_LAYER_VERSION, 0]) + _u16_le([len(chunks)]) + _u32_le([width])
+    path = out_dir / TEXT_LAYER_NAME
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(_u32_le(offsets))
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp, path)
+    return {
+        "file": TEXT_LAYER_NAME,
+        "width": width,
+        "words": sum(t["words"] for t in page_texts),
+        "bytes": path.stat().st_size,
+    }
+
+
+def read_text_layer(path: Path) -> List[List[Dict[str, Any]]]:
+    """解析文字层文件，返回每页的词列表 [{"text", "box": (x0, y0, x1, y1), "line"}]。"""
+    data = path.read_bytes()
+    if data[:4] != TEXT_LAYER_MAGIC:
+        raise ValueError(f"not a text layer file: {path}")
+    num_pages = array.array("H", data[6:8])
+    offsets = array.array("I", data[12:12 + 4 * (num_pages[0] + 1)])
+    for arr in (num_pages, offsets):
+        if sys.byteorder != "little":
+            arr.byteswap()
+    base = 12 + 4 * (num_pages[0] + 1)
+    pages: List[List[Dict[str, Any]]] = []
+    for i in range(num_pages[0]):
+        chunk = data[base + offsets[i]:base + offsets[i + 1]]
+        count = array.array("I", chunk[:4])
+        cols = array.array("H", chunk[4:4 + 12 * count[0]])
+        if sys.byteorder != "little":
+            count.byteswap()
+            cols.byteswap()
+        n = count[0]
+        x0, y0, x1, y1, line, lens = (cols[k * n:(k + 1) * n] for k in range(6))
+        pos = 4 + 12 * n
+        words = []
+        for j in range(n):
+            words.append({
+                "text": chunk[pos:pos + lens[j]].decode("utf-8", "replace"),
+                "box": (x0[j], y0[j], x1[j], y1[j]),
+                "line": line[j],
+            })
+            pos += lens[j]
+        pages.append(words)
+    return pages
+
+
+# ========== 跨期去重 ==========
+
+SHARED_DIR_NAME = "_shared"
+SHARED_INDEX_NAME = "index.json"
+# 差值哈希边长：32 → 1024 位。16 位边长下不同的正文页彼此只差几位，会被误判为重复
+PHASH_SIZE = 32
+# 汉明距离不超过该值视为同一页；页内改动一个词约变化 3 位，阈值需收紧到“近乎完全一致”
+PHASH_THRESHOLD = 2
+
+# 每个进程只读一次共享索引
+_SHARED_INDEXES: Dict[str, List[Dict[str, Any]]] = {}
+# 本进程新登记的候选单独存放，期内重复页同样可命中；它们的文件是本次刚写出的，可以安全复制
+_SESSION_CANDIDATES: Dict[str, List[Dict[str, Any]]] = {}
+
+
+def page_phash(page: "fitz.Page") -> str:
+    """低分辨率预渲染后计算差值哈希（dHash），不需要整页光栅化。"""
+    scale = 4.0 * PHASH_SIZE / float(page.rect.width)
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+    small = pixmap_to_pil(pix).convert("L").resize((PHASH_SIZE + 1, PHASH_SIZE), Image.LANCZOS)
+    px = small.load()
+    bits = 0
+    for y in range(PHASH_SIZE):
+        for x in range(PHASH_SIZE):
+            bits = (bits << 1) | (1 if px[x, y] > px[x + 1, y] else 0)
+    return f"{bits:0{PHASH_SIZE * PHASH_SIZE // 4}x}"
+
+
+def page_pixel_digest(page: "fitz.Page", width: int) -> str:
+    """按输出宽度光栅化后对像素求哈希；感知哈希只用于粗筛，复用前必须像素完全一致。"""
+    scale = float(width) / float(page.rect.width)
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+    return hashlib.sha1(pix.samples).hexdigest()
+
+
+def _hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def dedup_variant(settings: Dict[str, Any]) -> str:
+    """只有编码产物完全可互换（宽度档、格式、质量、编码策略一致）的页才能共用。"""
+    keys = ("width", "format", "quality", "tiers", "adaptive")
+    return json.dumps({k: settings[k] for k in keys if k in settings}, sort_keys=True)
+
+
+def load_shared_index(shared_dir: Path) -> List[Dict[str, Any]]:
+    path = shared_dir / SHARED_INDEX_NAME
+    if not path.exists():
+        return []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("entries", [])
+    except (OSError, ValueError):
+        return []
+
+
+def save_shared_index(shared_dir: Path, entries: List[Dict[str, Any]]) -> None:
+    path = shared_dir / SHARED_INDEX_NAME
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "entries": entries}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def _shared_entries(shared_dir: str) -> List[Dict[str, Any]]:
+    if shared_dir not in _SHARED_INDEXES:
+        _SHARED_INDEXES[shared_dir] = load_shared_index(Path(shared_dir))
+    return _SHARED_INDEXES[shared_dir]
+
+
+def _is_own_candidate(entry: Dict[str, Any], pages_root: Path, out_dir: Path) -> bool:
+    """以前各次运行登记的、文件仍在本期目录且尚未进入共享目录的候选。
+
+    重渲染同一期（如加 --text 或 --no-cache）时会命中自己上次的候选，复制进 _shared/
+    后本期文件被覆盖或清理，留下孤立文件，因此跳过。
+    """
+    own = out_dir.resolve()
+    for item in entry["files"].values():
+        if item.get("shared"):
+            continue
+        src = (pages_root / item["source"]).resolve()
+        if src == own or own in src.parents:
+            return True
+    return False
+
+
+def find_shared(
+    dedup: Dict[str, Any], variant: str, phash: str, out_dir: Path
+) -> List[Dict[str, Any]]:
+    """感知哈希在阈值内的候选，按汉明距离从近到远排列。"""
+    pages_root = Path(dedup["dir"]).parent
+    found: List[Tuple[int, Dict[str, Any]]] = []
+    pools = (
+        (_shared_entries(dedup["dir"]), True),
+        (_SESSION_CANDIDATES.get(dedup["dir"], []), False),
+    )
+    for entries, from_index in pools:
+        for entry in entries:
+            if entry["variant"] != variant:
+                continue
+            dist = _hamming(entry["phash"], phash)
+            if dist > dedup["threshold"]:
+                continue
+            if from_index and _is_own_candidate(entry, pages_root, out_dir):
+                continue
+            found.append((dist, entry))
+    found.sort(key=lambda item: item[0])
+    return [entry for _, entry in found]
+
+
+def promote_shared(shared_dir: Path, pages_root: Path, item: Dict[str, Any]) -> Optional[str]:
+    """把首次出现的页复制进共享目录，文件名取内容哈希；已存在则直接复用。
+
+    候选文件在各期目录里，之后可能被重渲染覆盖或删除（例如同一期改了 --quality），
+    与登记时的字节摘要不一致就返回 None，不能再当作这一页复用。
+    """
+    src = pages_root / item["source"]
+    try:
+        data = src.read_bytes()
+    except OSError:
+        return None
+    digest = hashlib.sha1(data).hexdigest()
+    if digest != item.get("digest"):
+        return None
+    name = f"{digest[:20]}{src.suffix}"
+    dest = shared_dir / name
+    if not dest.exists():
+        tmp = dest.with_name(f"{name}.{os.getpid()}.tmp")
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+    return name
+
+
+def shared_page_record(
+    entry: Dict[str, Any], out_dir: Path, dedup: Dict[str, Any], width: int
+) -> Optional[Dict[str, Any]]:
+    """命中共享索引：各档都指向 _shared/ 下的同一份文件，返回页面记录；候选文件已失效时返回 None。"""
+    shared_dir = Path(dedup["dir"])
+    pages_root = shared_dir.parent
+    tiers: Dict[str, Dict[str, Any]] = {}
+    for w, item in entry["files"].items():
+        name = item.get("shared") or promote_shared(shared_dir, pages_root, item)
+        if name is None:
+            return None
+        item["shared"] = name
+        rel = os.path.relpath(shared_dir / name, out_dir).replace(os.sep, "/")
+        tiers[w] = {"file": rel, "height": item["height"]}
+    record: Dict[str, Any] = dict(tiers[str(width)])
+    if len(tiers) > 1:
+        record["tiers"] = tiers
+    if entry.get("encoding"):
+        record["encoding"] = entry["encoding"]
+    record["shared"] = {
+        "variant": entry["variant"],
+        "phash": entry["phash"],
+        "pixels": entry["pixels"],
+        "files": {w: t["shared"] for w, t in entry["files"].items()},
+    }
+    return record
+
+
+def shared_candidate(
+    record: Dict[str, Any],
+    out_dir: Path,
+    dedup: Dict[str, Any],
+    variant: str,
+    phash: str,
+    pixels: str,
+    width: int,
+) -> Dict[str, Any]:
+    """未命中时把本页登记为候选：文件仍写在本期目录，再次出现时才复制进共享目录。
+
+    同时记下各档文件的字节摘要，复制前据此确认文件没有被之后的渲染改写。
+    """
+    pages_root = Path(dedup["dir"]).parent
+    tiers = record.get("tiers") or {str(width): {"file": record["file"], "height": record["height"]}}
+    files = {
+        w: {
+            "source": os.path.relpath(out_dir / t["file"], pages_root).replace(os.sep, "/"),
+            "digest": hashlib.sha1((out_dir / t["file"]).read_bytes()).hexdigest(),
+            "height": t["height"],
+        }
+        for w, t in tiers.items()
+    }
+    entry: Dict[str, Any] = {"phash": phash, "pixels": pixels, "variant": variant, "files": files}
+    if record.get("encoding"):
+        entry["encoding"] = record["encoding"]
+    return entry
+
+
+def merge_shared_index(shared_dir: Path, records: List[Dict[str, Any]]) -> Tuple[int, int]:
+    """主进程汇总各页记录写回共享索引，返回 (命中页数, 新登记候选数)。"""
+    entries = load_shared_index(shared_dir)
+    by_key = {(e["variant"], e["phash"], e.get("pixels")): e for e in entries}
+    hits = added = 0
+    for record in records:
+        if "shared" in record:
+            hits += 1
+            shared = record["shared"]
+            # 像素摘要与格式、质量无关，必须连同 variant 一起匹配，否则会把别的编码档的条目指向这份文件
+            entry = by_key.get((shared["variant"], shared["phash"], shared["pixels"]))
+            if entry is not None:
+                for w, name in shared["files"].items():
+                    if w in entry["files"]:
+                        entry["files"][w]["shared"] = name
+        elif "sharedCandidate" in record:
+            cand = record["sharedCandidate"]
+            key = (cand["variant"], cand["phash"], cand["pixels"])
+            old = by_key.get(key)
+            if old is None:
+                entries.append(cand)
+                by_key[key] = cand
+                added += 1
+            elif not any(item.get("shared") for item in old["files"].values()):
+                # 旧候选尚未复制进共享目录（本期重渲染，或其文件已被改写而未能命中），换成刚写出的文件
+                entries[entries.index(old)] = cand
+                by_key[key] = cand
+    save_shared_index(shared_dir, entries)
+    return hits, added
+
+
+def pixmap_to_pil(pix: "fitz.Pixmap") -> "Image.Image":
+    """Pixmap 转 Pillow 图像，直接读 MuPDF 缓冲区。
+
+    pix.samples 会先复制出一份 bytes；samples_mv 是同一块内存的 memoryview，
+    交给 frombuffer 后只剩 Pillow 解包进自身存储（RGB 在内部按 4 字节/像素存放）
+    这一次拷贝。渲染时固定 alpha=False，不再需要 convert("RGB")。
+    """
+    return Image.frombuffer(
+        "RGB", (pix.width, pix.height), pix.samples_mv, "raw", "RGB", pix.stride, 1
+    )
+
+
+def peak_rss_mb() -> Tuple[float, float]:
+    """返回 (本进程, 已回收子进程中最大) 的峰值 RSS，单位 MB；不支持的平台返回 0。"""
+    if resource is None:
+        return 0.0, 0.0
+    # Linux 上 ru_maxrss 单位为 KB，macOS 为字节
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit
+    return own, children
+
+
+def render_page(
+    page: "fitz.Page",
+    page_num: int,
+    out_dir: Path,
+    settings: Dict[str, Any],
+) -> Dict[str, Any]:
+    """渲染并保存单页，返回页面记录 {"file": 文件名, "height": 缩放后高度}。
+
+    settings 含 width / format / quality / tiers / tiles。配置了多档宽度时，只按
+    最大宽度光栅化一次，其余档位由该图缩小得到，写入 w{宽度}/ 子目录；
+    记录里额外带上 "tiers": {宽度: {"file", "height"}}。配置 tiles 时同一张
+    光栅图还会切成瓦片金字塔，记录里带上 "tiles" 描述。配置 adaptive 时先按
+    width 档图片分类并选择编码参数（各档共用），记录里带上 "encoding"。
+    配置 text 时顺带提取 PDF 文字层词框，记录里带上 "text"。配置 dedup 时先用
+    低分辨率预渲染算感知哈希粗筛共享索引，再按 width 光栅化比对像素哈希，完全一致
+    才跳过整页光栅化与编码，直接指向 _shared/ 下的文件；未命中则照常输出，并在
+    记录中附上候选条目。
+    """
+    width = settings["width"]
+    img_format = settings["format"]
+    quality = settings["quality"]
+    widths = sorted({width, *settings.get("tiers", [])})
+    tiles = settings.get("tiles")
+    raster_width = max(widths[-1], tiles["width"] if tiles else 0)
+    record: Dict[str, Any] = {}
+    if settings.get("text"):
+        # 页面已加载，顺带取文字层，省去单独的 OCR 流程
+        record["text"] = write_page_words(page, page_num, out_dir, width)
+    dedup = settings.get("dedup")
+    phash = pixels = None
+    if dedup and Image is not None:
+        phash = page_phash(page)
+        variant = dedup_variant(settings)
+        candidates = [] if tiles else find_shared(dedup, variant, phash, out_dir)
+        if candidates:
+            # 只差页脚等少量文字的页感知哈希可能相同，按输出分辨率逐像素确认
+            pixels = page_pixel_digest(page, width)
+            for entry in candidates:
+                if entry.get("pixels") != pixels:
+                    continue
+                hit = shared_page_record(entry, out_dir, dedup, width)
+                if hit is not None:
+                    record.update(hit)
+                    return record
+    rect = page.rect
+    scale = float(raster_width) / float(rect.width)
+    mat = fitz.Matrix(scale, scale)
+    pix = page.get_pixmap(matrix=mat, alpha=False)
+    if phash is not None and pixels is None and raster_width == width:
+        # 光栅宽度即输出宽度时，像素哈希直接取自这张图，省去一次渲染
+        pixels = hashlib.sha1(pix.samples).hexdigest()
+    out_name = _page_out_name(page_num, img_format)
+    out_path = out_dir / out_name
+    # 保存：优先用 Pillow 以支持 JPEG/WEBP 的 quality；否则退回 PNG。
+    if Image is None or (
+        img_format == "png" and len(widths) == 1 and not tiles and "adaptive" not in settings
+    ):
+        # 直接保存 PNG
+        # 若用户指定了 jpeg/webp 但 Pillow 不可用，回退为 PNG
+        png_path = out_path
+        if img_format != "png":
+            png_path = out_dir / f"{page_num:03d}.png"
+        pix.save(png_path.as_posix())
+        if Image is None and img_format != "png":
+            out_name = png_path.name
+        record.update({"file": out_name, "height": pix.height})
+        return record
+
+    pil_img = pixmap_to_pil(pix)
+    # Pillow 已持有像素，立即释放 MuPDF 侧的缓冲区
+    pix = None
+
+    def scaled(w: int) -> "Image.Image":
+        if w == pil_img.width:
+            return pil_img
+        h = max(1, round(pil_img.height * w / pil_img.width))
+        return pil_img.resize((w, h), Image.LANCZOS)
+
+    if tiles:
+        record["tiles"] = write_tile_pyramid(
+            pil_img, page_num, out_dir, img_format, quality, tiles["size"]
+        )
+
+    # 各档逐个缩放、编码、释放，同一时刻最多只持有原图 + width 档 + 当前档
+    primary = scaled(width)
+    adaptive = settings.get("adaptive")
+    encoding: Optional[Dict[str, Any]] = None
+    params: Dict[str, Any] = {"encoder": "lossy", "quality": quality}
+    # width 档已编码好的字节（自适应选择时得到），写出时直接用，不再编码第二遍
+    primary_data: Optional[bytes] = None
+    if adaptive is not None:
+        page_class = classify_page(primary)
+        baseline = encode_image(primary, img_format, params)
+        if page_class == "blank":
+            encoding = {"class": "blank", "encoder": "placeholder", "bytes": 0}
+        else:
+            params, primary_data = choose_encoding(
+                primary, page_class, img_format, quality, adaptive.get("budget", 0), baseline
+            )
+            encoding = {"class": page_class, **params, "bytes": len(primary_data)}
+        encoding["baselineBytes"] = len(baseline)
+        baseline = None
+
+    tiers: Dict[str, Dict[str, Any]] = {}
+    for w in reversed(widths):
+        img = primary if w == width else scaled(w)
+        if encoding and encoding["class"] == "blank":
+            name = write_blank_placeholder(out_dir, img, img_format)
+        else:
+            name = out_name if w == width else f"{_tier_dir(w)}/{out_name}"
+            if w == width and primary_data is not None:
+                data = primary_data
+            else:
+                data = encode_image(img, img_format, params)
+            with open(out_dir / name, "wb") as f:
+                f.write(data)
+            data = None
+        tiers[str(w)] = {"file": name, "height": img.height}
+        img = None
+    primary = pil_img = None
+    record.update(tiers[str(width)])
+    if len(widths) > 1:
+        record["tiers"] = tiers
+    if encoding:
+        record["encoding"] = encoding
+    if phash is not None:
+        if pixels is None:
+            pixels = page_pixel_digest(page, width)
+        cand = shared_candidate(record, out_dir, dedup, variant, phash, pixels, width)
+        _SESSION_CANDIDATES.setdefault(dedup["dir"], []).append(cand)
+        record["sharedCandidate"] = cand
+    return record
+
+
+def record_files(record: Dict[str, Any]) -> List[str]:
+    """页面记录涉及的全部产物文件（相对输出目录）。"""
+    files = [record["file"]]
+    files.extend(t["file"] for t in record.get("tiers", {}).values())
+    if "tiles" in record:
+        files.append(record["tiles"]["dzi"])
+    if "text" in record:
+        files.append(record["text"]["file"])
+    return files
+
+
+def _render_page_range(
+    pdf_path: str,
+    out_dir: str,
+    page_nums: List[int],
+    settings: Dict[str, Any],
+) -> List[Tuple[int, Dict[str, Any]]]:
+    """子进程入口：渲染一段页码，返回 [(页码, 页面记录), ...]。
+
+    PDF 在子进程内打开并保留（见 _worker_pdf），同一进程后续任务直接复用。
+    """
+    pdf = _worker_pdf(pdf_path)
+    results: List[Tuple[int, Dict[str, Any]]] = []
+    for page_num in page_nums:
+        page = pdf.load_page(page_num - 1)
+        results.append((page_num, render_page(page, page_num, Path(out_dir), settings)))
+    return results
+
+
+# 子进程内已打开的 PDF，最近使用的排在末尾；批量渲染时任务会在多期之间穿插
+_WORKER_PDFS: Dict[str, "fitz.Document"] = {}
+_WORKER_PDF_LIMIT = 4
+
+
+def _worker_pdf(pdf_path: str) -> "fitz.Document":
+    pdf = _WORKER_PDFS.pop(pdf_path, None)
+    if pdf is None:
+        pdf = fitz.open(pdf_path)
+    _WORKER_PDFS[pdf_path] = pdf
+    while len(_WORKER_PDFS) > _WORKER_PDF_LIMIT:
+        oldest = next(iter(_WORKER_PDFS))
+        _WORKER_PDFS.pop(oldest).close()
+    return pdf
+
+
+RENDER_CACHE_NAME = ".render-cache.json"
+RENDER_CACHE_VERSION = 1
+
+
+def page_content_hash(pdf: "fitz.Document", page: "fitz.Page") -> str:
+    """页面内容指纹：尺寸/旋转 + 内容流 + 引用的图片与表单对象原始流。
+
+    只读取 PDF 原始字节，不做光栅化，比渲染本身便宜得多。
+    """
+    h = hashlib.sha1()
+    h.update(repr((tuple(page.rect), page.rotation)).encode("ascii"))
+    h.update(page.read_contents())
+    xrefs = sorted(
+        {img[0] for img in page.get_images(full=True)}
+        | {xo[0] for xo in page.get_xobjects()}
+    )
+    for xref in xrefs:
+        h.update(str(xref).encode("ascii"))
+        h.update(pdf.xref_stream_raw(xref) or b"")
+    return h.hexdigest()
+
+
+def render_cache_key(content_hash: str, settings: Dict[str, Any]) -> str:
+    """缓存键 = 页面内容指纹 + 渲染参数；任一变化都会触发重新渲染。"""
+    raw = content_hash + json.dumps(settings, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def load_render_cache(out_dir: Path) -> Dict[str, Any]:
+    path = out_dir / RENDER_CACHE_NAME
+    if not path.exists():
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != RENDER_CACHE_VERSION:
+        return {}
+    return data.get("pages", {})
+
+
+def save_render_cache(out_dir: Path, pages: Dict[str, Any]) -> None:
+    # 先写临时文件再替换，避免中断时留下半截缓存
+    path = out_dir / RENDER_CACHE_NAME
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": RENDER_CACHE_VERSION, "pages": pages}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def split_page_ranges(page_nums: List[int], workers: int) -> List[List[int]]:
+    """把页码切成连续小段；段数多于进程数，避免个别重页拖慢整体。"""
+    if not page_nums:
+        return []
+    chunks = max(1, min(len(page_nums), workers * 4))
+    size = -(-len(page_nums) // chunks)
+    return [page_nums[i:i + size] for i in range(0, len(page_nums), size)]
+
+
+def estimate_page_record(page: "fitz.Page", page_num: int, settings: Dict[str, Any]) -> Dict[str, Any]:
+    """不渲染，按页面尺寸推算预期文件名与高度（流式模式下未就绪页的占位）。"""
+    width = settings["width"]
+    out_name = _page_out_name(page_num, settings["format"])
+    rect = page.rect
+
+    def height(w: int) -> int:
+        return max(1, round(rect.height * w / rect.width))
+
+    record: Dict[str, Any] = {"file": out_name, "height": height(width)}
+    if settings.get("tiers"):
+        record["tiers"] = {
+            str(w): {
+                "file": out_name if w == width else f"{_tier_dir(w)}/{out_name}",
+                "height": height(w),
+            }
+            for w in settings["tiers"]
+        }
+    return record
+
+
+def stream_page_order(page_nums: List[int], outline: List[Dict[str, Any]]) -> List[int]:
+    """流式渲染的页序：封面（首页）→ 各 outline 条目的起始页 → 其余页升序。"""
+    wanted = set(page_nums)
+    first = [page_nums[0]] if page_nums else []
+    starts = [int(item["pageNumber"]) for item in sorted(outline, key=lambda it: it.get("order", 0))]
+    order: List[int] = []
+    seen = set()
+    for page_num in first + starts + page_nums:
+        if page_num in wanted and page_num not in seen:
+            seen.add(page_num)
+            order.append(page_num)
+    return order
+
+
+def _build_render_info(
+    num_pages: int,
+    page_nums: List[int],
+    done: Dict[int, Dict[str, Any]],
+    planned: Dict[int, Dict[str, Any]],
+    settings: Dict[str, Any],
+    rendered: int,
+) -> Dict[str, Any]:
+    """按页码顺序汇总页面记录；planned 非空时未完成页用推算记录占位并标记 ready。"""
+    img_format = settings["format"]
+    records = [done.get(n) or planned[n] for n in page_nums]
+    info: Dict[str, Any] = {
+        "numPages": num_pages,
+        "renderedPages": rendered,
+        "images": [record["file"] for record in records],
+        "pageHeights": [record["height"] for record in records],
+        "width": settings["width"],
+        "format": "jpg" if img_format == "jpeg" else img_format,
+        "quality": settings["quality"],
+    }
+    if planned:
+        info["ready"] = [n in done for n in page_nums]
+    if settings.get("tiers"):
+        info["tiers"] = [
+            {
+                "width": w,
+                "images": [record["tiers"][str(w)]["file"] for record in records],
+                "pageHeights": [record["tiers"][str(w)]["height"] for record in records],
+            }
+            for w in settings["tiers"]
+        ]
+    if "adaptive" in settings:
+        info["encodings"] = [record.get("encoding") for record in records]
+    if settings.get("tiles"):
+        info["tiles"] = {
+            "tileSize": settings["tiles"]["size"],
+            "overlap": 0,
+            "format": info["format"],
+            "pages": [record.get("tiles") for record in records],
+        }
+    return info
+
+
+def page_cost(pdf: "fitz.Document", page: "fitz.Page") -> int:
+    """粗估单页渲染开销：内容流字节 + 引用图片的压缩字节 + 每页固定开销。
+
+    只读对象字典里的 Length，不解码流；用于批量渲染时按开销而非按期次分配任务。
+    """
+    cost = PAGE_BASE_COST + len(page.read_contents())
+    for img in page.get_images(full=True):
+        kind, value = pdf.xref_get_key(img[0], "Length")
+        if kind == "int":
+            cost += int(value)
+    return cost
+
+
+# 每页固定开销（字节当量）：光栅化 + 编码一页空白页大致相当于处理这么多内容字节
+PAGE_BASE_COST = 64 * 1024
+
+
+def prepare_render(
     pdf_path: Path,
     out_dir: Path,
     width: int = 1024,
@@ -46,66 +931,239 @@ def render_pdf_to_images(
     quality: int = 75,
     start_page: int = 1,
     end_page: Optional[int] = None,
+    use_cache: bool = True,
+    tiers: Optional[List[int]] = None,
+    tile_width: int = 0,
+    adaptive: bool = False,
+    byte_budget: int = 0,
+    extract_text: bool = False,
+    shared_dir: Optional[Path] = None,
+    estimate: bool = False,
+    with_costs: bool = False,
 ) -> Dict[str, Any]:
-    """
-    渲染 PDF 为图片。返回产物信息：
-      {
-        "numPages": int,
-        "images": ["001.webp", ...],
-        "pageHeights": [int, ...],  # 与 width 对应的缩放后高度
-      }
+    """渲染前的准备：整理渲染参数、查缓存，返回渲染计划。
+
+    计划中 todo 为需要渲染的页码，done 为已完成（含缓存命中）的页面记录；
+    estimate 为真时为每页推算占位记录（流式模式），with_costs 为真时附带每页开销估计。
+    渲染结果通过 record_page_result 写回，最后由 finish_render 汇总。
     """
     assert img_format in ("webp", "png", "jpeg", "jpg")
+    settings: Dict[str, Any] = {"width": width, "format": img_format, "quality": quality}
+    widths = sorted({width, *(tiers or [])})
+    if len(widths) > 1:
+        if Image is None:
+            raise SystemExit("多档宽度输出需要 Pillow。请先执行：python3 -m pip install pillow")
+        settings["tiers"] = widths
+        for w in widths:
+            if w != width:
+                ensure_dir(out_dir / _tier_dir(w))
+    if tile_width > 0:
+        if Image is None:
+            raise SystemExit("瓦片输出需要 Pillow。请先执行：python3 -m pip install pillow")
+        settings["tiles"] = {"width": tile_width, "size": TILE_SIZE}
+        ensure_dir(out_dir / TILES_DIR)
+    if adaptive:
+        if Image is None:
+            raise SystemExit("自适应编码需要 Pillow。请先执行：python3 -m pip install pillow")
+        settings["adaptive"] = {"budget": byte_budget}
+    if extract_text:
+        settings["text"] = True
+        ensure_dir(out_dir / TEXT_DIR)
+    if shared_dir is not None:
+        if Image is None:
+            raise SystemExit("跨期去重需要 Pillow。请先执行：python3 -m pip install pillow")
+        ensure_dir(shared_dir)
+        settings["dedup"] = {"dir": shared_dir.resolve().as_posix(), "threshold": PHASH_THRESHOLD}
+
     pdf = fitz.open(pdf_path.as_posix())
     num_pages = pdf.page_count
     if end_page is None or end_page > num_pages:
         end_page = num_pages
     if start_page < 1:
         start_page = 1
+    page_nums = list(range(start_page, end_page + 1))
 
-    images: List[str] = []
-    page_heights: List[int] = []
-
-    for page_num in range(start_page, end_page + 1):
-        page = pdf.load_page(page_num - 1)
-        rect = page.rect
-        scale = float(width) / float(rect.width)
-        mat = fitz.Matrix(scale, scale)
-        pix = page.get_pixmap(matrix=mat, alpha=False)
-        out_ext = ('jpg' if img_format in ('jpeg', 'jpg') else img_format)
-        out_name = f"{page_num:03d}.{out_ext}"
-        out_path = out_dir / out_name
-        # 保存：优先用 Pillow 以支持 JPEG/WEBP 的 quality；否则退回 PNG。
-        if img_format == "png" or Image is None:
-            # 直接保存 PNG
-            # 若用户指定了 jpeg/webp 但 Pillow 不可用，回退为 PNG
-            png_path = out_path
-            if img_format != "png":
-                png_path = out_dir / f"{page_num:03d}.png"
-            pix.save(png_path.as_posix())
-            if Image is None and img_format != "png":
-                out_name = png_path.name
+    done: Dict[int, Dict[str, Any]] = {}
+    planned: Dict[int, Dict[str, Any]] = {}
+    costs: Dict[int, int] = {}
+    cache = load_render_cache(out_dir) if use_cache else {}
+    keys: Dict[int, str] = {}
+    todo: List[int] = []
+    for page_num in page_nums:
+        entry = None
+        if use_cache or estimate or with_costs:
+            page = pdf.load_page(page_num - 1)
+            if estimate:
+                planned[page_num] = estimate_page_record(page, page_num, settings)
+            if with_costs:
+                costs[page_num] = page_cost(pdf, page)
+            if use_cache:
+                keys[page_num] = render_cache_key(page_content_hash(pdf, page), settings)
+                entry = cache.get(str(page_num))
+        if entry and entry.get("key") == keys[page_num] and all(
+            (out_dir / f).exists() for f in record_files(entry)
+        ):
+            done[page_num] = {k: v for k, v in entry.items() if k != "key"}
         else:
-            mode = "RGBA" if pix.alpha else "RGB"
-            pil_img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
-            if mode == "RGBA":
-                pil_img = pil_img.convert("RGB")
-            save_format = "WEBP" if img_format == "webp" else "JPEG"
-            pil_img.save(out_path.as_posix(), format=save_format, quality=quality, optimize=True)
-        images.append(out_name)
-        page_heights.append(pix.height)
-
+            todo.append(page_num)
     pdf.close()
+    if use_cache:
+        print(f"[INFO] 渲染缓存：命中 {len(done)} 页，需渲染 {len(todo)} 页")
     return {
-        "numPages": num_pages,
-        "images": images,
-        "pageHeights": page_heights,
-        "width": width,
-        "format": "jpg" if img_format == "jpeg" else img_format,
-        "quality": quality,
+        "pdf_path": pdf_path,
+        "out_dir": out_dir,
+        "settings": settings,
+        "num_pages": num_pages,
+        "page_nums": page_nums,
+        "todo": todo,
+        "done": done,
+        "planned": planned,
+        "costs": costs,
+        "keys": keys,
+        "cache": cache,
+        "use_cache": use_cache,
+        "shared_dir": shared_dir,
     }
 
 
+def record_page_result(plan: Dict[str, Any], page_num: int, record: Dict[str, Any]) -> None:
+    plan["done"][page_num] = record
+    if page_num in plan["keys"]:
+        plan["cache"][str(page_num)] = {"key": plan["keys"][page_num], **record}
+
+
+def partial_render_info(plan: Dict[str, Any]) -> Dict[str, Any]:
+    return _build_render_info(
+        plan["num_pages"], plan["page_nums"], plan["done"], plan["planned"],
+        plan["settings"], len(plan["todo"]),
+    )
+
+
+def finish_render(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """全部页完成后：落盘缓存、合并文字层、更新共享索引，返回产物信息。"""
+    out_dir = plan["out_dir"]
+    settings = plan["settings"]
+    done = plan["done"]
+    page_nums = plan["page_nums"]
+    if plan["use_cache"]:
+        save_render_cache(out_dir, plan["cache"])
+    info = partial_render_info(plan)
+    if settings.get("text"):
+        info["text"] = write_text_layer(out_dir, [done[n]["text"] for n in page_nums], settings["width"])
+    shared_dir = plan["shared_dir"]
+    if shared_dir is not None:
+        records = [done[n] for n in page_nums]
+        hits, added = merge_shared_index(shared_dir, records)
+        shared_files = {
+            f for record in records if "shared" in record for f in record_files(record) if f.startswith("..")
+        }
+        reused = sum((out_dir / f).stat().st_size for f in shared_files)
+        info["dedup"] = {"hits": hits, "added": added, "bytes": reused}
+    return info
+
+
+def render_pdf_to_images(
+    pdf_path: Path,
+    out_dir: Path,
+    width: int = 1024,
+    img_format: str = "webp",
+    quality: int = 75,
+    start_page: int = 1,
+    end_page: Optional[int] = None,
+    workers: int = 1,
+    use_cache: bool = True,
+    tiers: Optional[List[int]] = None,
+    tile_width: int = 0,
+    adaptive: bool = False,
+    byte_budget: int = 0,
+    outline: Optional[List[Dict[str, Any]]] = None,
+    on_batch: Optional[Callable[[Dict[str, Any]], None]] = None,
+    batch_size: int = 8,
+    extract_text: bool = False,
+    shared_dir: Optional[Path] = None,
+) -> Dict[str, Any]:
+    """
+    渲染 PDF 为图片。返回产物信息：
+      {
+        "numPages": int,
+        "images": ["001.webp", ...],
+        "pageHeights": [int, ...],  # 与 width 对应的缩放后高度
+        "tiers": [{"width", "images", "pageHeights"}, ...],  # 仅多档宽度时
+      }
+
+    tiers 为额外输出的宽度档位（如 [240, 640]）；width 档仍写在输出目录根部，
+    与旧版 manifest 保持兼容。tile_width > 0 时额外按该宽度输出 DZI 瓦片金字塔。
+    adaptive 为真时逐页分类（文字/照片/空白）并选择编码，byte_budget > 0 时
+    对有损编码按单页字节预算下调质量；每页的选择记录在 "encodings" 中。
+
+    workers > 1 时按页段分发到进程池，每个进程各自打开 PDF；
+    结果按页码排序，images/pageHeights 顺序与串行渲染一致。
+
+    use_cache 为真时读取 out_dir 下的 .render-cache.json：页面内容指纹与
+    渲染参数均未变化、且产物文件仍存在的页直接复用，不再光栅化。
+
+    传入 on_batch 即为流式模式：按 stream_page_order（封面、outline 起始页优先）
+    每 batch_size 页回调一次部分产物信息，未完成页以推算尺寸占位，
+    "ready" 列表标记每页是否已可用；缓存同步落盘，中断后可续跑。
+
+    extract_text 为真时同时提取每页词框（按 width 档像素），全部完成后合并为
+    out_dir/text-layer.bin，描述信息放在 "text" 中。
+
+    shared_dir 非空时启用跨期去重：按感知哈希查 shared_dir/index.json，近乎相同的
+    页（房产广告、栏目分隔页等）直接引用共享文件，统计放在 "dedup" 中。
+    """
+    plan = prepare_render(
+        pdf_path, out_dir, width, img_format, quality, start_page, end_page,
+        use_cache, tiers, tile_width, adaptive, byte_budget, extract_text, shared_dir,
+        estimate=on_batch is not None,
+    )
+    settings = plan["settings"]
+    todo = plan["todo"]
+    if on_batch is not None:
+        todo = stream_page_order(todo, outline or [])
+        batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+    else:
+        batches = split_page_ranges(todo, workers) if workers > 1 else [todo]
+
+    def finish_batch(batch: List[Tuple[int, Dict[str, Any]]]) -> None:
+        for page_num, record in batch:
+            record_page_result(plan, page_num, record)
+        if on_batch is not None:
+            if use_cache:
+                save_render_cache(out_dir, plan["cache"])
+            on_batch(partial_render_info(plan))
+
+    if on_batch is not None:
+        # 先发布缓存命中页，渲染开始前即可上线
+        on_batch(partial_render_info(plan))
+    if workers <= 1:
+        pdf = fitz.open(pdf_path.as_posix())
+        for chunk in batches:
+            batch = []
+            for page_num in chunk:
+                page = pdf.load_page(page_num - 1)
+                batch.append((page_num, render_page(page, page_num, out_dir, settings)))
+            finish_batch(batch)
+        pdf.close()
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # 进程池按提交顺序取任务，流式模式下优先页先完成
+            futures = [
+                pool.submit(
+                    _render_page_range,
+                    pdf_path.as_posix(),
+                    out_dir.as_posix(),
+                    chunk,
+                    settings,
+                )
+                for chunk in batches
+                if chunk
+            ]
+            for fut in as_completed(futures):
+                finish_batch(fut.result())
+    return finish_render(plan)
+
+
 def load_outline(outline_path: Optional[Path]) -> Dict[str, Any]:
     if not outline_path or not outline_path.exists():
         return {"issueTitle": "", "outline": []}
@@ -140,8 +1198,112 @@ def write_manifest(
         "base": "./",
         "generatedAt": __import__("datetime").datetime.utcnow().isoformat() + "Z",
     }
-    with open(out_dir / "manifest.json", "w", encoding="utf-8") as f:
+    if render_info.get("tiers"):
+        # 多档宽度：按宽度升序，前端取不小于显示宽度的最小一档
+        manifest["tiers"] = render_info["tiers"]
+    if render_info.get("tiles"):
+        # 每页一个 DZI 描述：按缩放级别只加载可见瓦片
+        manifest["tiles"] = render_info["tiles"]
+    if render_info.get("encodings"):
+        # 自适应编码：逐页记录页面类型与编码参数，与 images 一一对应
+        manifest["encodings"] = render_info["encodings"]
+    if render_info.get("text"):
+        # 文字层：列式二进制，坐标为 width 档像素，布局见 write_text_layer
+        manifest["text"] = render_info["text"]
+    if "ready" in render_info:
+        # 流式渲染：逐页标记图片是否已生成，未就绪页的 pageHeights 为推算值
+        manifest["ready"] = render_info["ready"]
+        manifest["complete"] = all(render_info["ready"])
+    # 先写临时文件再替换，流式发布时读者不会读到半截 manifest
+    path = out_dir / "manifest.json"
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def add_render_arguments(parser: argparse.ArgumentParser) -> None:
+    """渲染参数（单期与批量脚本共用）。"""
+    parser.add_argument("--width", type=int, default=1024, help="Target width (px).")
+    parser.add_argument("--format", choices=["webp", "png", "jpeg", "jpg"], default="webp")
+    parser.add_argument("--quality", type=int, default=75, help="Image quality for lossy formats.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of render processes. 1 renders serially; 0 uses all CPU cores.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"Ignore and do not update {RENDER_CACHE_NAME}; re-render every page.",
+    )
+    parser.add_argument(
+        "--tiers",
+        default="",
+        help="Extra output widths, comma separated (e.g. 240,640). "
+        "Rasterized once at the largest width and downscaled; written to w{width}/.",
+    )
+    parser.add_argument(
+        "--tiles",
+        action="store_true",
+        help=f"Also write a Deep Zoom tile pyramid ({TILE_SIZE}px tiles) per page under {TILES_DIR}/.",
+    )
+    parser.add_argument(
+        "--tile-width",
+        type=int,
+        default=4096,
+        help="Full-resolution width (px) of the deepest tile level.",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Classify pages (text/photo/blank) and pick the encoder per page.",
+    )
+    parser.add_argument(
+        "--byte-budget",
+        type=int,
+        default=0,
+        help="With --adaptive, lower lossy quality until each page fits this many bytes (0 = off).",
+    )
+    parser.add_argument(
+        "--text",
+        action="store_true",
+        help=f"Extract the PDF text layer (words + boxes at --width) into {TEXT_LAYER_NAME}.",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Reuse near-identical pages across issues via a perceptual-hash store in --shared-dir.",
+    )
+    parser.add_argument(
+        "--shared-dir",
+        default="",
+        help=f"Cross-issue shared page store (default: <out>/../{SHARED_DIR_NAME}).",
+    )
+
+
+def render_options_from_args(args: argparse.Namespace, out_dir: Path) -> Dict[str, Any]:
+    """把 add_render_arguments 的解析结果转成 prepare_render / render_pdf_to_images 的关键字参数。"""
+    shared_dir = None
+    if args.dedup:
+        shared_dir = Path(args.shared_dir) if args.shared_dir else out_dir.parent / SHARED_DIR_NAME
+    return {
+        "width": args.width,
+        "img_format": args.format,
+        "quality": args.quality,
+        "use_cache": not args.no_cache,
+        "tiers": [int(w) for w in args.tiers.split(",") if w.strip()],
+        "tile_width": args.tile_width if args.tiles else 0,
+        "adaptive": args.adaptive,
+        "byte_budget": args.byte_budget,
+        "extract_text": args.text,
+        "shared_dir": shared_dir,
+    }
+
+
+def resolve_workers(workers: int) -> int:
+    return workers if workers > 0 else (os.cpu_count() or 1)
 
 
 def main() -> None:
@@ -149,11 +1311,20 @@ def main() -> None:
     parser.add_argument("--pdf", required=True, help="Path to source PDF.")
     parser.add_argument("--outline", required=False, help="Path to outline JSON.")
     parser.add_argument("--out", required=True, help="Output directory.")
-    parser.add_argument("--width", type=int, default=1024, help="Target width (px).")
-    parser.add_argument("--format", choices=["webp", "png", "jpeg", "jpg"], default="webp")
-    parser.add_argument("--quality", type=int, default=75, help="Image quality for lossy formats.")
     parser.add_argument("--start", type=int, default=1, help="Start page (1-based).")
     parser.add_argument("--end", type=int, default=0, help="End page (inclusive). 0 means to last.")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Render cover and outline start pages first and rewrite manifest.json after each batch.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=8,
+        help="Pages per manifest update in --stream mode.",
+    )
+    add_render_arguments(parser)
     args = parser.parse_args()
 
     pdf_path = Path(args.pdf)
@@ -162,18 +1333,70 @@ def main() -> None:
     ensure_dir(out_dir)
 
     end_page = None if args.end == 0 else args.end
+    workers = resolve_workers(args.workers)
+    outline_info = load_outline(outline_path)
+    on_batch = None
+    if args.stream:
+        def on_batch(info: Dict[str, Any]) -> None:
+            write_manifest(out_dir, info, outline_info)
+            print(f"[INFO] manifest 已更新：{sum(info['ready'])}/{len(info['ready'])} 页就绪")
+
+    t0 = time.perf_counter()
     render_info = render_pdf_to_images(
         pdf_path=pdf_path,
         out_dir=out_dir,
-        width=args.width,
-        img_format=args.format,
-        quality=args.quality,
         start_page=args.start,
         end_page=end_page,
+        workers=workers,
+        outline=outline_info["outline"],
+        on_batch=on_batch,
+        batch_size=args.batch_size,
+        **render_options_from_args(args, out_dir),
     )
-    outline_info = load_outline(outline_path)
+    elapsed = time.perf_counter() - t0
     write_manifest(out_dir, render_info, outline_info)
-    print(f"完成：共 {render_info['numPages']} 页，输出目录：{out_dir}")
+    rendered = render_info["renderedPages"]
+    print(
+        f"完成：共 {render_info['numPages']} 页，本次渲染 {rendered} 页"
+        f"（缓存复用 {len(render_info['images']) - rendered} 页），"
+        f"{workers} 进程，耗时 {elapsed:.1f}s（{rendered / max(elapsed, 1e-6):.1f} 页/秒），输出目录：{out_dir}"
+    )
+    print_render_report(out_dir, render_info)
+    own_rss, child_rss = peak_rss_mb()
+    if own_rss:
+        msg = f"峰值内存：主进程 {own_rss:.0f} MB"
+        if workers > 1:
+            msg += f"，单个渲染进程最高 {child_rss:.0f} MB"
+        print(msg)
+
+
+def print_render_report(out_dir: Path, render_info: Dict[str, Any]) -> None:
+    for tier in render_info.get("tiers", []):
+        size = sum((out_dir / name).stat().st_size for name in tier["images"])
+        print(f"  - {tier['width']}px：{size / 1024 / 1024:.1f} MB")
+    if render_info.get("encodings"):
+        print_encoding_report(render_info["encodings"])
+    if render_info.get("dedup"):
+        dd = render_info["dedup"]
+        print(
+            f"跨期去重：{dd['hits']} 页引用共享图片（{dd['bytes'] / 1024:.0f} KB 无需重新上传），"
+            f"新登记候选 {dd['added']} 页"
+        )
+
+
+def print_encoding_report(encodings: List[Dict[str, Any]]) -> None:
+    """自适应编码报告：各类页数与相对统一质量设置节省的字节。"""
+    counts: Dict[str, int] = {}
+    for enc in encodings:
+        counts[enc["class"]] = counts.get(enc["class"], 0) + 1
+    total = sum(enc["bytes"] for enc in encodings)
+    baseline = sum(enc["baselineBytes"] for enc in encodings)
+    saved = baseline - total
+    pct = saved * 100.0 / baseline if baseline else 0.0
+    print(
+        "自适应编码：" + "，".join(f"{k} {v} 页" for k, v in sorted(counts.items()))
+        + f"；{total / 1024:.0f} KB（统一设置 {baseline / 1024:.0f} KB，节省 {saved / 1024:.0f} KB / {pct:.1f}%）"
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+全文检索倒排索引（构建期预生成，前端按需加载分片）
+
+目录结构（{output-dir}/data/search/）：
+  manifest.json     {"version", "shards", "issues": {issueId: [分片号, ...]}}
+  titles.json       {issueId: [文章标题, ...]}，下标即文章序号（与文章 id 的末段一致）
+  {xx}.json         分片：{词项: {issueId: [文章序号, 得分, 文章序号, 得分, ...]}}
+
+分词：NFKC 规范化并转小写后，连续的中日韩汉字切成二元组（单字则保留单字），
+字母数字串整体作为一个词（单个字母忽略）。词项按首字符码位对分片数取模决定所在分片
+（xx 为两位十六进制），前端用同样规则只拉取查询词所在的分片。
+src/lib/search.ts 中的分词与分片规则须与这里保持一致。
+
+每构建一期，只检查该期旧词项与新词项所在的分片：先删掉该期的全部倒排项再写入新的，
+内容确有变化的分片才改写；多进程并行构建时用文件锁串行化合并。批量构建（build_archive.py）
+时各期只暂存词项，全部构建完后一次合并。
+"""
+
+import json
+import os
+import re
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except Exception:  # Windows 上没有 fcntl，合并时不加锁
+    fcntl = None
+
+SEARCH_DIR = "search"
+# 批量构建时各期暂存词项的子目录（不以 .json 结尾，分片数变化时不会被当作旧分片清掉）
+PENDING_DIR = ".pending"
+SEARCH_VERSION = 1
+DEFAULT_SHARDS = 256
+
+# 字段权重：标题命中最重要，正文最次
+FIELD_WEIGHTS = {"title": 8, "summary": 4, "insight": 2, "body": 1}
+# 单字段内词频封顶，避免长文靠重复词刷分
+MAX_TF = 10
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+TOKEN_RUN_RE = re.compile(r"[㐀-䶿一-鿿豈-﫿]+|[a-z0-9]+")
+# 正文中的图片、HTML 标签与链接不参与索引
+MARKUP_RE = re.compile(r"!\[[^\]]*\]\([^)]*\)|<[^>]+>|https?://\S+")
+
+
+def tokenize(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens: List[str] = []
+    for run in TOKEN_RUN_RE.findall(text):
+        if WORD_RE.fullmatch(run):
+            if len(run) > 1 or run.isdigit():
+                tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def shard_of(term: str, shards: int) -> str:
+    return f"{ord(term[0]) % shards:02x}"
+
+
+def article_terms(fields: Dict[str, str]) -> Dict[str, int]:
+    """按字段加权统计一篇文章的词项得分：{词项: 得分}"""
+    scores: Counter = Counter()
+    for field, text in fields.items():
+        if not text:
+            continue
+        if field == "body":
+            text = MARKUP_RE.sub(" ", text)
+        weight = FIELD_WEIGHTS[field]
+        for term, tf in Counter(tokenize(text)).items():
+            scores[term] += weight * min(tf, MAX_TF)
+    return dict(scores)
+
+
+def _load_json(path: Path, default: Any) -> Any:
+    if not path.exists():
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_json_atomic(path: Path, data: Any) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def _issue_postings(doc_terms: Iterable[Dict[str, int]], shards: int) -> Dict[str, Dict[str, List[int]]]:
+    """把一期各文章的词项得分整理为 {分片号: {词项: [文章序号, 得分, ...]}}"""
+    postings: Dict[str, List[int]] = {}
+    for idx, terms in enumerate(doc_terms):
+        for term, score in terms.items():
+            postings.setdefault(term, []).extend((idx, score))
+    # 每个词项内按得分从高到低排列，前端可只取前若干篇
+    by_shard: Dict[str, Dict[str, List[int]]] = {}
+    for term, flat in postings.items():
+        pairs = sorted(zip(flat[::2], flat[1::2]), key=lambda p: -p[1])
+        by_shard.setdefault(shard_of(term, shards), {})[term] = [v for pair in pairs for v in pair]
+    return by_shard
+
+
+def merge_index(
+    search_dir: Path,
+    issues: Dict[str, Tuple[List[str], Iterable[Dict[str, int]]]],
+    shards: int = DEFAULT_SHARDS,
+) -> Dict[str, Any]:
+    """把若干期的倒排项一次合并进索引（替换这些期旧的倒排项）
+
+    issues 为 {issueId: (titles, doc_terms)}，titles 与 doc_terms 按文章序号对齐；
+    doc_terms 为 article_terms 的结果。内容没有变化的分片不改写。
+    返回统计：{"terms", "postings", "shards", "bytes"}，shards 与 bytes 只计实际改写的分片。
+    """
+    search_dir.mkdir(parents=True, exist_ok=True)
+    new = {issue_id: _issue_postings(doc_terms, shards) for issue_id, (_, doc_terms) in issues.items()}
+
+    lock_file = open(search_dir / ".lock", "w")
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        manifest = _load_json(search_dir / "manifest.json", {})
+        manifest_changed = not manifest
+        if manifest.get("version") != SEARCH_VERSION or manifest.get("shards") != shards:
+            # 分片数或格式变化时旧分片作废，从头建立；其他期的倒排项随之清空，须逐期重建
+            stale = sorted(i for i in manifest.get("issues", {}) if i not in issues)
+            if stale:
+                print(
+                    f"[WARN] 检索索引分片数或格式已变化（分片 {manifest.get('shards')} → {shards}，"
+                    f"版本 {manifest.get('version')} → {SEARCH_VERSION}），旧索引已清空；"
+                    f"以下 {len(stale)} 期需要重新构建才能被检索到：{', '.join(stale)}"
+                )
+            for old in search_dir.glob("*.json"):
+                old.unlink()
+            manifest = {"version": SEARCH_VERSION, "shards": shards, "issues": {}}
+            manifest_changed = True
+
+        touched = set()
+        for issue_id, by_shard in new.items():
+            touched |= set(manifest["issues"].get(issue_id, [])) | set(by_shard)
+        written = size = 0
+        for shard in sorted(touched):
+            path = search_dir / f"{shard}.json"
+            data: Dict[str, Dict[str, List[int]]] = _load_json(path, {})
+            removed: Dict[Tuple[str, str], List[int]] = {}
+            for term in list(data):
+                for issue_id in new:
+                    if issue_id in data[term]:
+                        removed[(term, issue_id)] = data[term].pop(issue_id)
+                if not data[term]:
+                    del data[term]
+            added: Dict[Tuple[str, str], List[int]] = {}
+            for issue_id, by_shard in new.items():
+                for term, flat in by_shard.get(shard, {}).items():
+                    data.setdefault(term, {})[issue_id] = flat
+                    added[(term, issue_id)] = flat
+            if added == removed:
+                continue
+            written += 1
+            if data:
+                _write_json_atomic(path, data)
+                size += path.stat().st_size
+            elif path.exists():
+                path.unlink()
+
+        for issue_id, by_shard in new.items():
+            if manifest["issues"].get(issue_id) != sorted(by_shard):
+                manifest["issues"][issue_id] = sorted(by_shard)
+                manifest_changed = True
+        if manifest_changed:
+            _write_json_atomic(search_dir / "manifest.json", manifest)
+        all_titles = _load_json(search_dir / "titles.json", {})
+        if any(all_titles.get(issue_id) != titles for issue_id, (titles, _) in issues.items()):
+            all_titles.update({issue_id: titles for issue_id, (titles, _) in issues.items()})
+            _write_json_atomic(search_dir / "titles.json", all_titles)
+    finally:
+        lock_file.close()
+
+    terms = [flat for by_shard in new.values() for part in by_shard.values() for flat in part.values()]
+    return {
+        "terms": len(terms),
+        "postings": sum(len(v) // 2 for v in terms),
+        "shards": written,
+        "bytes": size,
+    }
+
+
+def merge_issue_index(
+    search_dir: Path,
+    issue_id: str,
+    titles: List[str],
+    doc_terms: Iterable[Dict[str, int]],
+    shards: int = DEFAULT_SHARDS,
+) -> Dict[str, Any]:
+    """把一期的倒排项合并进索引（替换该期旧的倒排项），见 merge_index"""
+    return merge_index(search_dir, {issue_id: (titles, list(doc_terms))}, shards)
+
+
+def stage_issue_index(
+    search_dir: Path,
+    issue_id: str,
+    titles: List[str],
+    doc_terms: Iterable[Dict[str, int]],
+    shards: int = DEFAULT_SHARDS,
+) -> Path:
+    """只把一期的词项暂存到 {search_dir}/.pending/，由 merge_pending_index 统一合并
+
+    批量构建时每期都合并一次会在文件锁下反复改写同一批分片；暂存后结束时合并一次即可。
+    """
+    pending_dir = search_dir / PENDING_DIR
+    pending_dir.mkdir(parents=True, exist_ok=True)
+    path = pending_dir / f"{issue_id}.json"
+    _write_json_atomic(path, {"shards": shards, "titles": titles, "docTerms": list(doc_terms)})
+    return path
+
+
+def merge_pending_index(search_dir: Path) -> Optional[Dict[str, Any]]:
+    """合并 stage_issue_index 暂存的各期词项并删除暂存文件；没有暂存时返回 None"""
+    pending = sorted((search_dir / PENDING_DIR).glob("*.json"))
+    if not pending:
+        return None
+    issues: Dict[str, Tuple[List[str], Iterable[Dict[str, int]]]] = {}
+    shards = DEFAULT_SHARDS
+    for path in pending:
+        staged = _load_json(path, {})
+        issues[path.stem] = (staged["titles"], staged["docTerms"])
+        shards = staged["shards"]
+    stats = merge_index(search_dir, issues, shards)
+    for path in pending:
+        path.unlink()
+    stats["issues"] = len(issues)
+    return stats